@@ -8,28 +8,51 @@
 version 0.2.3
 a scheme interpreter, written by ori yonay
 
-TODO:
-    - add 'let' feature
-
 """
 
-import copy # for deep copying of lists
-
-# for user-defined symbols
-SYMBOLS = {'newline' : '\n'}
-GLOBALS = {'NUM_TEMPS' : 0} # global back-end variables
-BOOLS = {False : '#f', True: '#t'} # global TRUE and FALSE
-SPECIAL_WORDS = ['define', 'if', 'or', 'and', 'lambda']
-# a list for in-built functions (used in map() and filter() to verify function)
-# (in a separate list to avoid letting user overload these)
-INBUILTFUNCTIONS = ['+', '-', '*', '/', '%', 'modulus', '=', 'eq?',
-                    '!=', 'neq?', '>', 'greater?', '<', 'smaller?',
-                    '>=', 'geq?', '<=', 'leq?', 'list', 'car', 'cdr',
-                    'cadr', 'caddr', 'cadddr', 'caddddr', 'reverse',
-                    'append', 'cons', 'length', 'at', 'even?', 'odd?',
-                    'positive?', 'list?', 'display', 'map', 'filter',
-                    'del', 'read', 'read-line'
-]
+import argparse # for the command-line interface
+import atexit # for writing out file ports left open
+import collections # for the LRU caches of memoized functions
+import concurrent.futures # for the process pools of pmap and pfilter
+import functools # for folding arithmetic over whole vectors
+import hashlib # for keying the cache of parsed script files
+import io # for loading images (and string ports)
+import json # for profiling reports
+import mmap # for loading images
+import operator # for arithmetic over whole vectors
+import os # for the number of cpus (and the cache of parsed script files)
+import pickle # for the cache of parsed script files (and images)
+import re # for the tokenizer
+import sys # for raising python's recursion limit (and exit statuses)
+import threading # for the limits of evaluations running in each thread
+import time # for the profiler (and time limits)
+import tracemalloc # for memory limits
+import weakref # for keeping track of open file ports
+from fractions import Fraction # for exact rational numbers
+try:
+    import numpy # for faster arithmetic over vectors of floats, if it's installed
+except ImportError:
+    numpy = None
+
+# escape sequences allowed in string literals (any other escaped character is itself):
+STRING_ESCAPES = {'n' : '\n', 't' : '\t'}
+# a single token (or a stretch of whitespace or a comment) at some index in the source:
+# scheme's syntax for numbers: integers, fractions (like 1/3) and decimals (with
+# an optional exponent). python reads more than that as numbers (like inf, nan
+# and 1_000), which are names here:
+NUMBER = re.compile(r'[+-]?(?:\d+/\d+|\d+|(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)')
+TOKEN = re.compile(r'''(?P<space>\s+|;[^\n]*)|(?P<paren>[()'])|(?P<string>"(?:[^"\\]|\\[\s\S])*"?)|(?P<atom>[^\s()'";]+)''')
+DEFAULT_MAX_DEPTH = 10000 # how deeply non-tail calls may nest by default
+FRAMES_PER_DEPTH = 6 # (roughly) how many python frames one level of nesting uses
+DEFAULT_MEMO_SIZE = 1024 # how many results a memoized function keeps by default
+DEFAULT_WORKERS = None # how many processes pmap and pfilter use by default (None for one per cpu)
+CHUNKS_PER_WORKER = 4 # how many chunks pmap and pfilter split a list into for each process
+CACHE_DIR = '__dscache__' # where the parsed forms of script files are cached (next to each file)
+CACHE_VERSION = 4 # bumped whenever what the parser produces changes, so old caches aren't used
+OPTIMIZE = True # whether function bodies are optimized when defined (see Compiler.optimize)
+STEPS_PER_CHECK = 1000 # how often (in steps) evaluations check their time and memory limits
+PORT_BUFFER_SIZE = 8192 # how many characters an output port holds before writing them out
+IMAGE_MAGIC = b'DragonScheme image 2\n' # what image files start with (bumped whenever their contents change)
 
 # Error: a class for returning error messages
 class Error:
@@ -39,72 +62,146 @@ class Error:
     def __str__(self): # overload print() function
         return self.message
 
+# LimitError: the error an evaluation stops with when it goes over one of the
+#             limits set for it (see Budget)
+class LimitError(Error):
+    pass
+
+# Symbol: a type for names read from source, so the evaluator can tell them
+# apart from numbers and booleans once the source has been parsed
+class Symbol(str):
+    def intern(name):
+        # the one symbol with this name, so symbols with the same name are the
+        # same object (and compare and hash as fast as they can):
+        symbol = SYMBOL_TABLE.get(name)
+        if symbol is None:
+            symbol = SYMBOL_TABLE[name] = Symbol(name)
+        return symbol
+
+    def __reduce__(self):
+        # (unpickled symbols are interned too)
+        return (Symbol.intern, (str(self),))
+
+SYMBOL_TABLE = {} # every symbol interned so far, by name
+
+# Pair: a cons cell. lists are chains of pairs ending in NIL (the empty list),
+#       so car, cdr and cons never copy and lists can share their tails
+class Pair:
+    __slots__ = ('car', 'cdr')
+
+    def __init__(self, car, cdr):
+        self.car = car
+        self.cdr = cdr
+
+    def __iter__(self):
+        # iterate over the elements of the list starting at this pair:
+        pair = self
+        while isinstance(pair, Pair):
+            yield pair.car
+            pair = pair.cdr
+
+    def __str__(self):
+        return Utils.to_text(self)
+
+    def __reduce__(self):
+        # pickle a list as the python list of its elements (and its last cdr),
+        # so long lists don't nest as deeply as they are long:
+        elements, tail = [], self
+        while isinstance(tail, Pair):
+            elements.append(tail.car)
+            tail = tail.cdr
+        return (Utils.to_pairs, (elements, tail))
+
+# Nil: the type of the empty list
+class Nil:
+    __slots__ = ()
+
+    def __iter__(self):
+        return iter(())
+
+    def __str__(self):
+        return Utils.to_text(self)
+
+    def __reduce__(self):
+        # there's only one empty list, even when unpickled:
+        return 'NIL'
+
+NIL = Nil()
+
+# Boolean: the type of #t and #f (of which there's one each), kept apart from
+#          strings so the string "#t" isn't true
+class Boolean:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __reduce__(self):
+        # (unpickled booleans are the same two)
+        return 'TRUE' if self is TRUE else 'FALSE'
+
+TRUE, FALSE = Boolean('#t'), Boolean('#f')
+BOOLS = {False : FALSE, True: TRUE} # global TRUE and FALSE
+
 # Functions: a class with IN-BUILT FUNCTIONS
 class Functions:
     def f_add(args):
+        # get the numeric value of each (symbolic or literal) argument:
+        numbers = Functions.numbers('+', args)
+        if isinstance(numbers, Error):
+            return Functions.vectorwise('+', args, numbers)
+
         result = 0
-        for a in args:
-            # add the symbolic value (or literal value) of each:
-            if a in SYMBOLS:
-                result += Utils.attempt_float(SYMBOLS[a])
-            else: result += Utils.attempt_float(a)
-        # convert result to integer if it's an integer:
-        if result.is_integer():
-            return Utils.attempt_int(result)
-        #otherwise, return the result as a float:
-        return result
+        for n in numbers:
+            result += n
+        return Utils.simplify(result)
 
     def f_subtract(args):
-        result = Utils.attempt_float(SYMBOLS[args[0]]) if args[0] in SYMBOLS else float(args[0])
-
-        for a in args[1:]:
-            if a in SYMBOLS:
-                result -= Utils.attempt_float(SYMBOLS[a])
-            else: result -= Utils.attempt_float(a)
-        # convert result to integer if it's an integer:
-        if result.is_integer():
-            return Utils.attempt_int(result)
-        #otherwise, return the result as a float:
-        return result
+        numbers = Functions.numbers('-', args)
+        if isinstance(numbers, Error):
+            return Functions.vectorwise('-', args, numbers)
+
+        result = numbers[0]
+        for n in numbers[1:]:
+            result -= n
+        return Utils.simplify(result)
 
     def f_multiply(args):
-        result = Utils.attempt_float(SYMBOLS[args[0]]) if args[0] in SYMBOLS else float(args[0])
-        for a in args[1:]:
-            if a in SYMBOLS:
-                result *= Utils.attempt_float(SYMBOLS[a])
-            else: result *= Utils.attempt_float(a)
-
-        # convert result to integer if it's an integer:
-        if result.is_integer():
-            return Utils.attempt_int(result)
-        #otherwise, return the result as a float:
-        return result
+        numbers = Functions.numbers('*', args)
+        if isinstance(numbers, Error):
+            return Functions.vectorwise('*', args, numbers)
+
+        result = numbers[0]
+        for n in numbers[1:]:
+            result *= n
+        return Utils.simplify(result)
 
     def f_divide(args):
-        result = Utils.attempt_float(SYMBOLS[args[0]]) if args[0] in SYMBOLS else Utils.attempt_float(args[0])
-        for a in args[1:]:
-            if a in SYMBOLS:
-                result /= Utils.attempt_float(SYMBOLS[a])
-            else: result /= Utils.attempt_float(a)
-
-        # convert result to integer if it's an integer:
-        if result.is_integer():
-            return Utils.attempt_int(result)
-        #otherwise, return the result as a float:
-        return result
+        numbers = Functions.numbers('/', args)
+        if isinstance(numbers, Error):
+            return Functions.vectorwise('/', args, numbers)
+
+        result = numbers[0]
+        for n in numbers[1:]:
+            if n == 0:
+                return Error('(/) error: division by zero.')
+            result = Utils.divide(result, n)
+        return Utils.simplify(result)
 
     def f_modulus(args):
-        result = Utils.attempt_float(SYMBOLS[args[0]]) if args[0] in SYMBOLS else Utils.attempt_float(args[0])
-        for a in args[1:]:
-            if a in SYMBOLS:
-                result %= Utils.attempt_float(SYMBOLS[a])
-            else: result %= Utils.attempt_float(a)
-
-        # convert result to integer if it's an integer:
-        if result.is_integer():
-            return Utils.attempt_int(result)
-        #otherwise, return the result as a float:
-        return result
+        numbers = Functions.numbers('%', args)
+        if isinstance(numbers, Error):
+            return numbers
+
+        result = numbers[0]
+        for n in numbers[1:]:
+            if n == 0:
+                return Error('(%) error: division by zero.')
+            result %= n
+        return Utils.simplify(result)
 
     def f_equal(x):
         for i in range(len(x) - 1):
@@ -115,544 +212,2189 @@ class Functions:
         return BOOLS[True] if (Functions.f_equal(x) == BOOLS[False]) else BOOLS[False]
 
     def f_greater(args):
-        args = Functions.replaceWithSymbolValues(args)
-        for i in range(len(args) - 1):
-            try:
-                if Utils.attempt_float(args[i]) <= Utils.attempt_float(args[i+1]):
-                    return BOOLS[False]
-            except:
-                return Error('(>) error: invalid symbol.')
+        numbers = Functions.numbers('>', args)
+        if isinstance(numbers, Error):
+            return numbers
+        for i in range(len(numbers) - 1):
+            if numbers[i] <= numbers[i+1]:
+                return BOOLS[False]
         return BOOLS[True]
 
     def f_smaller(args):
-        args = Functions.replaceWithSymbolValues(args)
-        for i in range(len(args) - 1):
-            try:
-                if Utils.attempt_float(args[i]) >= Utils.attempt_float(args[i+1]):
-                    return BOOLS[False]
-            except:
-                return Error('(<) error: invalid symbol.')
+        numbers = Functions.numbers('<', args)
+        if isinstance(numbers, Error):
+            return numbers
+        for i in range(len(numbers) - 1):
+            if numbers[i] >= numbers[i+1]:
+                return BOOLS[False]
         return BOOLS[True]
 
     def f_greater_or_equal(args):
-        args = Functions.replaceWithSymbolValues(args)
-        for i in range(len(args) - 1):
-            try:
-                if Utils.attempt_float(args[i]) < Utils.attempt_float(args[i+1]):
-                    return BOOLS[False]
-            except:
-                return Error('(>=) error: invalid symbol.')
+        numbers = Functions.numbers('>=', args)
+        if isinstance(numbers, Error):
+            return numbers
+        for i in range(len(numbers) - 1):
+            if numbers[i] < numbers[i+1]:
+                return BOOLS[False]
         return BOOLS[True]
 
     def f_smaller_or_equal(args):
-        args = Functions.replaceWithSymbolValues(args)
-        for i in range(len(args) - 1):
-            try:
-                if Utils.attempt_float(args[i]) > Utils.attempt_float(args[i+1]):
-                    return BOOLS[False]
-            except:
-                return Error('(<=) error: invalid symbol.')
-        return BOOLS[True]
-
-    def f_define(args):
-        # split args into 2 arguments:
-        if args.startswith('('):
-            # then this is a function definition:
-            Functions.f_definefunction(args)
-            return
-        else:
-            args = args.split(' ', 1)
-
-        if args[1].startswith('('):
-            # then we have to evaluate args[1]:
-            args[1] = evaluate(args[1])
-
-        # in the case of a list or a copy (define a b):
-        if args[1] in SYMBOLS:
-            SYMBOLS[args[0]] = SYMBOLS[args[1]]
-        # otherwise, treat the definition normally:
-        else: SYMBOLS[args[0]] = args[1]
-
-    def f_definefunction(args):
-        # defines a function.
-        # first, split function declaration from definition:
-        # (so '(square x) (* x x)' becomes 'square x' and '(* x x)')
-        args = args.split(') ', 1)
-        declaration = args[0][1:]
-        definition = args[1]
-
-        # split function declaration by space:
-        declaration = declaration.split()
-
-        # create a new Function object for this function:
-        SYMBOLS[declaration[0]] = Function(declaration[1:], definition)
-
-    def handle_if(cmd):
-        # tokenize command:
-        cmd = Utils.tokenize(cmd)
-
-        # make sure we only have 2 or 3 args:
-        if len(cmd) < 2:
-            return Error('If-statement error: not enough arguments! (%s provided.)' %len(cmd))
-        if len(cmd) > 3:
-            return Error('If-statement error: too many arguments! (%s provided).' %len(cmd))
-
-        if evaluate(cmd[0]) == BOOLS[True]: # if the statement is true
-            return evaluate(cmd[1])
-        elif len(cmd) == 3: # if an 'else' statement was provided
-            return evaluate(cmd[2])
-
-    def handle_or(cmd):
-        tokens = Utils.tokenize(cmd)
-        # if any tokens evaluate to true, then OR is true:
-        for token in tokens:
-            if evaluate(token) == BOOLS[True]:
-                return BOOLS[True]
-        # if none of the tokens evaluated to true, then it's false:
-        return BOOLS[False]
-
-    def handle_and(cmd):
-        tokens = Utils.tokenize(cmd)
-        # if any tokens evaluate to false, then AND is false:
-        for token in tokens:
-            if evaluate(token) == BOOLS[False]:
+        numbers = Functions.numbers('<=', args)
+        if isinstance(numbers, Error):
+            return numbers
+        for i in range(len(numbers) - 1):
+            if numbers[i] > numbers[i+1]:
                 return BOOLS[False]
-        # if none of the tokens were false, then it's true:
         return BOOLS[True]
 
-    def handle_lambda(expr):
-        # all we're doing is defining a temporary function that'll be garbage-collected
-        # after its execution:
-        Functions.f_define('(<TEMP_' + str(GLOBALS['NUM_TEMPS']) + '> ' + expr[1:])
-        GLOBALS['NUM_TEMPS'] += 1
-        return '<TEMP_' + str(GLOBALS['NUM_TEMPS']-1) + '>' # -1 since we just incremented it
-
     def make_list(elements):
-        # replace any symbols (including <TEMP_X>):
-        for i in range(len(elements)):
-            # if this element is in the symbol table (so can't be a list):
-            if not isinstance(elements[i], list) and elements[i] in SYMBOLS:
-                elements[i] = SYMBOLS[elements[i]]
-        # store list temporarily in symbols as <TEMP_X>:
-        listname = '<TEMP_' + str(GLOBALS['NUM_TEMPS']) + '>'
-        SYMBOLS[listname] = elements
-        GLOBALS['NUM_TEMPS'] += 1
-        return listname
+        return Utils.to_pairs(elements)
 
-    def f_car(arg):
-        # make sure exactly one argument was given:
-        if len(arg) != 1:
-            return Error('(car) error: expected 1 argument, %s provided.' % len(arg))
-        if arg[0] not in SYMBOLS:
-            return Error('(car) error: symbol %s not found.' % arg[0])
+    def make_vector(elements):
+        # a vector is a python list, for random access:
+        return list(elements)
 
-        return SYMBOLS[arg[0]][0]
+    def f_car(arg):
+        pair = arg[0]
+        if not isinstance(pair, Pair):
+            return Error('(car) error: %s is not a pair.' % arg[0])
+        return pair.car
 
     def f_cdr(arg):
-        # make sure exactly one argument was given:
-        if len(arg) != 1:
-            return Error('(cdr) error: expected 1 argument, %s provided.' % len(arg))
-        # make sure argument exists in symbols:
-        if arg[0] not in SYMBOLS:
-            return Error('(cdr) error: symbol %s not found.' % arg[0])
-        if len(SYMBOLS[arg[0]]) == 0: # we can't cdr an empty list:
+        pair = arg[0]
+        if pair is NIL: # we can't cdr an empty list:
             return Error('(cdr) error: list provided is empty.')
-        return Functions.make_list(SYMBOLS[arg[0]][1:])
+        if not isinstance(pair, Pair):
+            return Error('(cdr) error: %s is not a pair.' % arg[0])
+        return pair.cdr
 
     def f_cadr(arg): # useless since we have 'at' function, but still here
-        if arg[0] not in SYMBOLS:
-            return Error('(cadr) error: symbol %s not found.' % arg[0])
         try:
-            return SYMBOLS[arg[0]][1]
+            return Utils.nth(arg[0], 1)
         except:
             return Error('(cadr) error: index out of bounds')
 
     def f_caddr(arg): # useless since we have 'at' function, but still here
-        if arg[0] not in SYMBOLS:
-            return Error('(caddr) error: symbol %s not found.' % arg[0])
         try:
-            return SYMBOLS[arg[0]][2]
+            return Utils.nth(arg[0], 2)
         except:
             return Error('(caddr) error: index out of bounds')
 
     def f_cadddr(arg): # useless since we have 'at' function, but still here
-        if arg[0] not in SYMBOLS:
-            return Error('(cadddr) error: symbol %s not found.' % arg[0])
         try:
-            return SYMBOLS[arg[0]][3]
+            return Utils.nth(arg[0], 3)
         except:
             return Error('(cadddr) error: index out of bounds')
 
     def f_caddddr(arg): # useless since we have 'at' function, but still here
-        if arg[0] not in SYMBOLS:
-            return Error('(caddddr) error: symbol %s not found.' % arg[0])
         try:
-            return SYMBOLS[arg[0]][4]
+            return Utils.nth(arg[0], 4)
         except:
             return Error('(caddddr) error: index out of bounds')
 
     def f_reverse(arg):
-        # make sure exactly one argument was given:
-        if len(arg) != 1:
-            return Error('(reverse) error: expected 1 argument, %s provided.' % len(arg))
-
-        # make sure arg is in symbol table:
-        if arg[0] not in SYMBOLS:
-            return Error('(reverse) error: symbol %s not found.' % arg[0])
-
-        if len(SYMBOLS[arg[0]]) == 0: # we can't reverse an empty list:
-            return Functions.make_list([])
-
-        # return the reversed list:
-        return Functions.make_list(SYMBOLS[arg[0]][::-1])
+        mylist = arg[0]
+        if not Utils.issequence(mylist):
+            return Error('(reverse) error: %s is not a list.' % arg[0])
+
+        # consing each element onto the result reverses the list:
+        result = NIL
+        for element in mylist:
+            result = Pair(element, result)
+        return result
 
     def f_append(args):
-        print(args)
-        newlist = []
-        for arg in args:
-            newlist.extend(SYMBOLS[arg] if arg in SYMBOLS else arg)
-        return Functions.make_list(newlist)
+        # with no lists to append, the result is empty:
+        if len(args) == 0:
+            return NIL
+
+        # the last list is shared, and only the ones before it are copied:
+        result = args[-1]
+        for arg in reversed(args[:-1]):
+            mylist = arg
+            if not Utils.issequence(mylist):
+                return Error('(append) error: %s is not a list.' % arg)
+            result = Utils.to_pairs(list(mylist), result)
+        return result
 
     def f_cons(args):
-        newlist = []
-        for arg in args:
-            newlist.append(SYMBOLS[arg] if arg in SYMBOLS else arg)
-        return Functions.make_list(newlist)
+        return Pair(args[0], args[1])
 
     def f_length(arg):
-        # make sure exactly one argument was given:
-        if len(arg) != 1:
-            return Error('(length) error: expected 1 argument, %s provided.' % len(arg))
-        if arg[0] not in SYMBOLS:
-            return Error('(length) error: symbol %s not found.' % arg[0])
+        mylist = arg[0]
+        if isinstance(mylist, list):
+            return len(mylist)
+        if not Utils.issequence(mylist):
+            return Error('(length) error: %s is not a list.' % arg[0])
 
-        return len(SYMBOLS[arg[0]])
+        length = 0
+        for element in mylist:
+            length += 1
+        return length
 
     def f_at(args):
-        # make sure arg[0] in symbol table:
-        if args[0] not in SYMBOLS:
-            return Error('(at) error: symbol %s not found.' % args[0])
+        mylist = args[0]
+        if not Utils.issequence(mylist):
+            return Error('(at) error: %s is not a list.' % args[0])
 
         # if 2 arguments provided:
         if len(args) == 2:
             try:
-                return SYMBOLS[args[0]][Utils.attempt_int(args[1])]
+                return Utils.nth(mylist, Utils.to_number(args[1]))
             except:
                 return Error('(at) error: index out of bounds or invalid: %s' % args[1])
 
         indices = []
         for idx in args[1:]:
             try:
-                indices.append(SYMBOLS[args[0]][Utils.attempt_int(idx)])
+                indices.append(Utils.nth(mylist, Utils.to_number(idx)))
             except:
                 return Error('(at) error: index out of bounds or invalid: %s' % idx)
 
         return Functions.make_list(indices)
 
-    def printlist(mylist):
-        # if the list is empty:
-        if len(mylist) == 0:
-            print('()', end='')
-            return
+    def f_list_to_vector(arg):
+        mylist = arg[0]
+        if not Utils.issequence(mylist):
+            return Error('(list->vector) error: %s is not a list.' % arg[0])
+        return list(mylist)
 
-        # otherwise:
-        print('(', end='')
-        for i in range(len(mylist)-1):
-            if isinstance(mylist[i], list):
-                Functions.printlist(mylist[i])
-                print(', ', end='')
-            else: print(mylist[i], end=', ')
-        if isinstance(mylist[-1], list):
-            Functions.printlist(mylist[-1])
-        else: print(mylist[-1], end='')
-        print(')', end='')
+    def f_vector_to_list(arg):
+        vector = arg[0]
+        if not isinstance(vector, list):
+            return Error('(vector->list) error: %s is not a vector.' % arg[0])
+        return Utils.to_pairs(vector)
 
     def iseven(x):
-        x = Functions.replaceWithSymbolValues(x)
-        if isinstance(x, list):
+        if Utils.issequence(x):
             for i in x:
                 temp = Functions.iseven(i)
                 if temp == BOOLS[False]: return BOOLS[False]
                 elif temp == None: return None
             return BOOLS[True]
         else:
-            x = Utils.attempt_float(x)
+            x = Utils.to_number(x)
             if x == None: return None
             return BOOLS[(x % 2 == 0)]
 
     def isodd(x):
-        x = Functions.replaceWithSymbolValues(x)
-        if isinstance(x, list):
+        if Utils.issequence(x):
             for i in x:
                 temp = Functions.isodd(i)
                 if temp == BOOLS[False]: return BOOLS[False]
                 elif temp == None: return None
             return BOOLS[True]
         else:
-            x = Utils.attempt_float(x)
+            x = Utils.to_number(x)
             if x == None: return None
             return BOOLS[(x % 2 != 0)]
 
     def ispositive(x):
-        x = Functions.replaceWithSymbolValues(x)
-        if isinstance(x, list):
+        if Utils.issequence(x):
             for i in x:
                 temp = Functions.ispositive(i)
                 if temp != BOOLS[True]:
                     return temp
             return BOOLS[True]
         else:
-            x = Utils.attempt_float(x)
+            x = Utils.to_number(x)
             if x == None: return None
             return BOOLS[(x > 0)]
 
     def islist(arg):
-        # make sure exactly one argument was given:
-        if len(arg) != 1:
-            return Error('(list?) error: expected 1 argument, %s provided.' % len(arg))
+        # a list is a chain of pairs ending in NIL:
+        mylist = arg[0]
+        while isinstance(mylist, Pair):
+            mylist = mylist.cdr
+        return BOOLS[mylist is NIL]
 
-        if arg[0] in SYMBOLS:
-            return BOOLS[isinstance(SYMBOLS[arg[0]], list)]
+    def isnull(arg):
+        # checking for the empty list doesn't need to walk the list like length does:
+        return BOOLS[arg[0] is NIL]
 
-        # if the argument is not in our symbol table currently, it can't be a list:
-        return BOOLS[False]
+    def isvector(arg):
+        return BOOLS[isinstance(arg[0], list)]
 
     def display(args):
-        args = Functions.replaceWithSymbolValues(args)
-        for i in args:
-            if isinstance(i, list):
-                Functions.printlist(i)
-                print()
-            else:
-                print(i)
-
-    def replaceWithSymbolValues(x):
-        if isinstance(x, list):
-            for i in range(len(x)):
-                if isinstance(x[i], list):
-                    x[i] = Functions.replaceWithSymbolValues(x[i])
-                elif x[i] in SYMBOLS:
-                    x[i] = SYMBOLS[x[i]]
-            return x
-        else:
-            if x in SYMBOLS:
-                return SYMBOLS[x]
-        return x
+        # a port after the values is where they go (instead of the current
+        # output port); each value is on its own line:
+        port = Utils.output()
+        if len(args) > 1 and isinstance(args[-1], Port):
+            port, args = args[-1], args[:-1]
+        if port.closed():
+            return Error('(display) error: %s is closed.' % port)
+        port.write(''.join(Utils.to_text(i) + '\n' for i in args))
+
+    def open_output_file(arg):
+        path = arg[0]
+        if not isinstance(path, str) or isinstance(path, Symbol):
+            return Error('(open-output-file) error: %s is not a file name.' % path)
+        try:
+            port = Port(open(path, 'w'), path)
+        except OSError as e:
+            return Error('(open-output-file) error: could not open %s: %s' % (path, e.strerror))
+        # whatever's still in its buffer is written out at exit if it's never
+        # closed (see flushPorts):
+        OPEN_PORTS.add(port)
+        return port
+
+    def close_output_port(arg):
+        if not isinstance(arg[0], Port):
+            return Error('(close-output-port) error: %s is not an output port.' % arg[0])
+        arg[0].close()
+
+    def flush_output(args):
+        port = args[0] if len(args) > 0 else Utils.output()
+        if not isinstance(port, Port):
+            return Error('(flush-output) error: %s is not an output port.' % port)
+        port.flush()
+
+    def current_output_port(args):
+        return Utils.output()
+
+    def isoutputport(arg):
+        return BOOLS[isinstance(arg[0], Port)]
+
+    def with_output_to_string(arg):
+        # call a function of no arguments with the current output port (of the
+        # interpreter running it) writing to a string instead, returning the
+        # string:
+        function = arg[0]
+        if not Utils.isfunction(function):
+            return Error('(with-output-to-string) error: %s is not a function.' % function)
+        interpreter = RUNNING.interpreter
+        if interpreter is None:
+            return Error('(with-output-to-string) error: no evaluation is running.')
+        outer = interpreter.output
+        port = interpreter.output = Port(io.StringIO(), 'string')
+        try:
+            result = Utils.caller(function, 0)([])
+        finally:
+            interpreter.output = outer
+        if isinstance(result, Error):
+            return result
+        port.flush()
+        return port.stream.getvalue()
+
+    def vectorwise(name, args, error):
+        # arithmetic with vectors among its arguments is done element by element
+        # (with numbers used against every element); with no vectors, the error
+        # from reading the arguments as numbers stands:
+        lengths = set(len(a) for a in args if isinstance(a, list))
+        if len(lengths) == 0:
+            return error
+        if len(lengths) > 1:
+            return Error('(%s) error: vectors of different lengths.' % name)
+        length = lengths.pop()
+
+        columns = []
+        for a in args:
+            if not isinstance(a, list):
+                n = Utils.to_number(a)
+                if n is None:
+                    return Error('(%s) error: %s is not a number.' % (name, a))
+                a = [n] * length
+            columns.append(a)
+
+        # vectors of numbers are done in bulk, and anything else one element
+        # at a time:
+        result = Utils.bulk(name, columns)
+        if result is None:
+            function = INBUILTFUNCTIONS[name][0]
+            result = []
+            for row in zip(*columns):
+                value = function(list(row))
+                if isinstance(value, Error):
+                    return value
+                result.append(value)
+        return result
 
-    def printsymbols():
-        Functions.printlist(list(SYMBOLS.keys()))
-        print()
+    def numbers(name, args):
+        # make sure each argument of function name is a number:
+        numbers = []
+        for a in args:
+            n = Utils.to_number(a)
+            if n is None:
+                return Error('(%s) error: %s is not a number.' % (name, a))
+            numbers.append(n)
+        return numbers
 
-    def map(args):
-        # args[0] is the function name that we're applying on args[1].
-        # make sure exactly 2 arguments were provided:
-        if len(args) != 2:
-            return Error('(map) error: expected 2 arguments, got %s.' % len(args))
+    def printsymbols(symbols):
+        Utils.output().write(Utils.to_text(Utils.to_pairs(list(symbols.keys()))) + '\n')
 
+    def map(args):
+        # args[0] is the function that we're applying on the rest (taking an
+        # element from each, up to the end of the shortest).
         # make sure first argument is actually a function:
-        if (args[0] in SYMBOLS and not isinstance(SYMBOLS[args[0]], Function)) and args[0] not in INBUILTFUNCTIONS:
-            return Error('(map) error: symbol %s is not a function.' % args[0])
-
-        # make sure second argument (list) is actually a list and is in our symbol table:
-        if args[1] not in SYMBOLS:
-            return Error('(map) error: symbol %s not found.' % args[1])
-        if not isinstance(SYMBOLS[args[1]], list):
-            return Error('(map) error: symbol %s is not a list.' % args[1])
-
-        # make a copy of the list:
-        elements_copy = copy.deepcopy(SYMBOLS[args[1]])
-
-        # apply the function to each:
-        for i in range(len(elements_copy)):
-            elements_copy[i] = apply([args[0], elements_copy[i]])
-
-        return Functions.make_list(elements_copy)
+        function = args[0]
+        if not Utils.isfunction(function):
+            return Error('(map) error: %s is not a function.' % function)
+
+        # make sure the other arguments are actually lists (or vectors, or hash
+        # tables, whose elements are their (key . value) pairs):
+        for mylist in args[1:]:
+            if not Utils.issequence(mylist) and not isinstance(mylist, HashTable):
+                return Error('(map) error: %s is not a list.' % mylist)
+        columns = [mylist if isinstance(mylist, list) else list(mylist) for mylist in args[1:]]
+        length = min(len(column) for column in columns)
+        columns = [column[:length] for column in columns]
+        mylist = args[1]
+
+        # in-built arithmetic and numeric predicates over numbers are done in bulk:
+        elements = None
+        if isinstance(function, str):
+            if function in BULK_OPERATORS:
+                elements = Utils.bulk(function, columns)
+            elif function in BULK_PREDICATES and len(columns) == 1 and Utils.numeric(columns[0]):
+                predicate = BULK_PREDICATES[function]
+                elements = [BOOLS[predicate(x)] for x in columns[0]]
+            if isinstance(elements, Error):
+                return elements
+
+        # otherwise, apply the function to each:
+        if elements is None:
+            call = Utils.caller(function, len(columns))
+            elements = []
+            for row in zip(*columns):
+                value = call(list(row))
+                if isinstance(value, Error):
+                    return value
+                elements.append(value)
+
+        # vectors map to vectors, and lists to lists:
+        if isinstance(mylist, list):
+            return Functions.make_vector(elements)
+        return Functions.make_list(elements)
 
     def filter(args):
-        # args[0] is the function name that we're applying on args[1].
-        # make sure exactly 2 arguments were provided:
-        if len(args) != 2:
-            return Error('(filter) error: expected 2 arguments, got %s.' % len(args))
-
+        # args[0] is the function that we're applying on args[1].
         # make sure first argument is actually a function:
-        if (args[0] in SYMBOLS and not isinstance(SYMBOLS[args[0]], Function)) and args[0] not in INBUILTFUNCTIONS:
-            return Error('(filter) error: symbol %s is not a function.' % args[0])
-
-        # make sure second argument (list) is actually a list and is in our symbol table:
-        if args[1] not in SYMBOLS:
-            return Error('(filter) error: symbol %s not found.' % args[1])
-        if not isinstance(SYMBOLS[args[1]], list):
-            return Error('(filter) error: symbol %s is not a list.' % args[1])
+        if not Utils.isfunction(args[0]):
+            return Error('(filter) error: %s is not a function.' % args[0])
+
+        # make sure second argument is actually a list (or vector, or hash table):
+        mylist = args[1]
+        if not Utils.issequence(mylist) and not isinstance(mylist, HashTable):
+            return Error('(filter) error: %s is not a list.' % args[1])
+
+        # numeric predicates over numbers are done in bulk:
+        function = args[0]
+        if isinstance(function, str) and function in BULK_PREDICATES:
+            column = mylist if isinstance(mylist, list) else list(mylist)
+            if Utils.numeric(column):
+                elements = list(filter(BULK_PREDICATES[function], column))
+                if isinstance(mylist, list):
+                    return elements
+                return Functions.make_list(elements)
 
         # make an empty list:
         elements = []
 
         # apply the function to each, and only add element to our list
         # if the function returns true:
-        for element in SYMBOLS[args[1]]:
-            if apply([args[0], element]) == BOOLS[True]:
+        call = Utils.caller(function, 1)
+        for element in mylist:
+            value = call([element])
+            if isinstance(value, Error):
+                return value
+            if value == BOOLS[True]:
                 elements.append(element)
 
+        # (filtering a hash table keeps the entries whose pairs pass)
+        if isinstance(mylist, HashTable):
+            return HashTable((pair.car, pair.cdr) for pair in elements)
+        if isinstance(mylist, list):
+            return Functions.make_vector(elements)
         return Functions.make_list(elements)
 
-    def f_delete(args):
+    def make_hash_table(args):
+        # an empty hash table, or one holding the (key . value) pairs of a list:
+        table = HashTable()
+        if len(args) == 1:
+            if not Utils.issequence(args[0]):
+                return Error('(make-hash-table) error: %s is not a list.' % args[0])
+            for pair in args[0]:
+                if not isinstance(pair, Pair):
+                    return Error('(make-hash-table) error: %s is not a (key . value) pair.' % pair)
+                if not table.set(pair.car, pair.cdr):
+                    return Error("(make-hash-table) error: %s can't be a key." % pair.car)
+        return table
+
+    def hash_ref(args):
+        # the value of a key, or args[2] if it isn't in the table:
+        table, key = args[0], args[1]
+        if not isinstance(table, HashTable):
+            return Error('(hash-ref) error: %s is not a hash table.' % table)
+        entry = table.entries.get(Utils.hashkey(key))
+        if entry is not None:
+            return entry[1]
+        if len(args) == 3:
+            return args[2]
+        return Error('(hash-ref) error: key %s not found.' % key)
+
+    def hash_set(args):
+        table, key, value = args
+        if not isinstance(table, HashTable):
+            return Error('(hash-set!) error: %s is not a hash table.' % table)
+        if not table.set(key, value):
+            return Error("(hash-set!) error: %s can't be a key." % key)
+
+    def hash_remove(args):
+        # (removing a key that isn't there does nothing)
+        table, key = args
+        if not isinstance(table, HashTable):
+            return Error('(hash-remove!) error: %s is not a hash table.' % table)
+        table.entries.pop(Utils.hashkey(key), None)
+
+    def hash_has_key(args):
+        table, key = args
+        if not isinstance(table, HashTable):
+            return Error('(hash-has-key?) error: %s is not a hash table.' % table)
+        return BOOLS[Utils.hashkey(key) in table.entries]
+
+    def hash_count(arg):
+        if not isinstance(arg[0], HashTable):
+            return Error('(hash-count) error: %s is not a hash table.' % arg[0])
+        return len(arg[0].entries)
+
+    def hash_keys(arg):
+        if not isinstance(arg[0], HashTable):
+            return Error('(hash-keys) error: %s is not a hash table.' % arg[0])
+        return Functions.make_list([key for key, value in arg[0].entries.values()])
+
+    def hash_to_list(arg):
+        # the (key . value) pairs of a hash table:
+        if not isinstance(arg[0], HashTable):
+            return Error('(hash->list) error: %s is not a hash table.' % arg[0])
+        return Functions.make_list(list(arg[0]))
+
+    def ishashtable(arg):
+        return BOOLS[isinstance(arg[0], HashTable)]
+
+    def pmap(args):
+        # like map, but over a pool of processes:
+        results = Functions.parallel('pmap', args)
+        if isinstance(results, Error):
+            return results
+        if isinstance(args[1], list):
+            return Functions.make_vector(results)
+        return Functions.make_list(results)
+
+    def pfilter(args):
+        # like filter, but over a pool of processes:
+        results = Functions.parallel('pfilter', args)
+        if isinstance(results, Error):
+            return results
+        elements = [element for element, keep in zip(args[1], results) if keep == BOOLS[True]]
+        if isinstance(args[1], list):
+            return Functions.make_vector(elements)
+        return Functions.make_list(elements)
+
+    def parallel(name, args):
+        # apply args[0] to each element of args[1] in a pool of args[2] (or
+        # DEFAULT_WORKERS) processes, returning the results in order:
+        function, mylist = args[0], args[1]
+        if not Utils.isfunction(function):
+            return Error('(%s) error: %s is not a function.' % (name, function))
+        if not Utils.issequence(mylist):
+            return Error('(%s) error: %s is not a list.' % (name, mylist))
+        workers = DEFAULT_WORKERS
+        if len(args) == 3:
+            workers = args[2]
+            if not isinstance(workers, int) or workers < 1:
+                return Error('(%s) error: number of workers must be a positive integer, got %s.' % (name, workers))
+
+        elements = list(mylist)
+        if len(elements) == 0:
+            return []
+
+        # values are sent to (and back from) the workers as forms that evaluate
+        # to them, and each worker starts with the definitions of the
+        # interpreter the function was defined in:
+        interpreter = function.env.interpreter if isinstance(function, Function) else Interpreter()
+        definitions = [(symbol, Utils.to_form(value)) for symbol, value in interpreter.symbols.items()]
+        forms = [Utils.to_form(element) for element in elements]
+        if workers is None:
+            workers = min(os.cpu_count() or 1, len(forms))
+        size = -(-len(forms) // (workers * CHUNKS_PER_WORKER)) # (rounded up)
+        chunks = [forms[i:i + size] for i in range(0, len(forms), size)]
+
+        # the workers get what's left of the limits of the evaluation running
+        # here (and it's only waited on for as long as it has left):
+        running = RUNNING.interpreter
+        budget = running.budget if running is not None else None
+        limits = budget.remaining() if budget is not None else (None, None, None)
+
+        # the workers start as copies of this process, so what's waiting to be
+        # written out is written now (instead of once by each of them):
+        STDOUT.flush()
+        Utils.output().flush()
+        pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=poolInit,
+                                                      initargs=(definitions, interpreter.max_depth, limits))
+        try:
+            functionForm = Utils.to_form(function)
+            futures = [pool.submit(poolRun, functionForm, chunk) for chunk in chunks]
+            chunks = [future.result(timeout=budget.remaining()[1] if budget is not None else None)
+                      for future in futures]
+        except concurrent.futures.TimeoutError:
+            return budget.overtime()
+        except Exception as e:
+            return Error('(%s) error: a worker process failed: %s' % (name, e))
+        finally:
+            # (workers still running stop at their own limits, so waiting for
+            # them doesn't take long)
+            pool.shutdown(cancel_futures=True)
+
+        # the first error from any worker is the result:
+        results = []
+        for chunk in chunks:
+            if isinstance(chunk, Error):
+                return chunk
+            results.extend(chunk)
+        return [evaluateNode(form, interpreter.globals) if isinstance(form, list) else form for form in results]
+
+    def force(arg):
+        # anything that isn't a promise is already its own value:
+        if isinstance(arg[0], Promise):
+            return arg[0].force()
+        return arg[0]
+
+    def stream_cdr(arg):
+        # the rest of a stream (a pair whose cdr is a promise), forced:
+        stream = arg[0]
+        if not isinstance(stream, Pair):
+            return Error('(stream-cdr) error: %s is not a stream.' % stream)
+        return Functions.force([stream.cdr])
+
+    def stream_map(args):
+        # a stream of the results of applying args[0] to each element of the
+        # stream args[1], each worked out when it's first needed:
+        function = args[0]
+        if not Utils.isfunction(function):
+            return Error('(stream-map) error: %s is not a function.' % function)
+        call = Utils.caller(function, 1)
+
+        def mapped(stream):
+            if stream is NIL:
+                return NIL
+            if not isinstance(stream, Pair):
+                return Error('(stream-map) error: %s is not a stream.' % stream)
+            value = call([stream.car])
+            if isinstance(value, Error):
+                return value
+            return Pair(value, Promise(lambda: Utils.then(Functions.force([stream.cdr]), mapped)))
+        return mapped(args[1])
+
+    def stream_filter(args):
+        # a stream of the elements of the stream args[1] that args[0] is true
+        # for, found when they're first needed:
+        function = args[0]
+        if not Utils.isfunction(function):
+            return Error('(stream-filter) error: %s is not a function.' % function)
+        call = Utils.caller(function, 1)
+
+        def filtered(stream):
+            # skip to the next element that passes (one at a time, rather
+            # than recursing):
+            while stream is not NIL:
+                if not isinstance(stream, Pair):
+                    return Error('(stream-filter) error: %s is not a stream.' % stream)
+                value = call([stream.car])
+                if isinstance(value, Error):
+                    return value
+                if value == BOOLS[True]:
+                    rest = stream.cdr
+                    return Pair(stream.car, Promise(lambda: Utils.then(Functions.force([rest]), filtered)))
+                stream = Functions.force([stream.cdr])
+                if isinstance(stream, Error):
+                    return stream
+            return NIL
+        return filtered(args[1])
+
+    def stream_take(args):
+        # a stream of the first args[1] elements of the stream args[0]:
+        n = args[1]
+        if not isinstance(n, int) or n < 0:
+            return Error('(stream-take) error: %s is not a valid number of elements.' % n)
+
+        def taken(stream, n):
+            if n == 0 or stream is NIL:
+                return NIL
+            if not isinstance(stream, Pair):
+                return Error('(stream-take) error: %s is not a stream.' % stream)
+            return Pair(stream.car, Promise(lambda: Utils.then(Functions.force([stream.cdr]), lambda rest: taken(rest, n - 1))))
+        return taken(args[0], n)
+
+    def stream_to_list(args):
+        # a list of the elements of the stream args[0] (or only its first
+        # args[1] elements, for streams that go on forever):
+        stream, n = args[0], None
+        if len(args) == 2:
+            n = args[1]
+            if not isinstance(n, int) or n < 0:
+                return Error('(stream->list) error: %s is not a valid number of elements.' % n)
+        elements = []
+        while stream is not NIL and (n is None or len(elements) < n):
+            if not isinstance(stream, Pair):
+                return Error('(stream->list) error: %s is not a stream.' % stream)
+            elements.append(stream.car)
+            stream = Functions.force([stream.cdr])
+            if isinstance(stream, Error):
+                return stream
+        return Functions.make_list(elements)
+
+    def f_range(args):
+        # a stream of the numbers from args[0] up to (but not including) args[1]
+        # (or forever, without one), args[2] (or 1) apart, each made when it's
+        # first needed:
+        numbers = Functions.numbers('range', args)
+        if isinstance(numbers, Error):
+            return numbers
+        start = numbers[0]
+        end = numbers[1] if len(numbers) > 1 else None
+        step = numbers[2] if len(numbers) == 3 else 1
+        if step == 0:
+            return Error('(range) error: step must not be 0.')
+
+        def numbersfrom(n):
+            if end is not None and ((step > 0 and n >= end) or (step < 0 and n <= end)):
+                return NIL
+            return Pair(n, Promise(lambda: numbersfrom(Utils.simplify(n + step))))
+        return numbersfrom(start)
+
+    def f_expand_optimized(arg):
+        # the source of a user-defined function as it runs, after optimizing:
+        function = arg[0]
+        if not isinstance(function, Function):
+            return Error('(expand-optimized) error: %s is not a user-defined function.' % function)
+        body = function.body
+        if OPTIMIZE:
+            scope = Compiler.scope_of(function.env).extend(function.args)
+            body = [Compiler.optimize(node, scope) for node in body]
+        if function.name is None:
+            declaration = [Symbol.intern('lambda'), list(function.args)]
+        else:
+            declaration = [Symbol.intern('define'), [function.name] + list(function.args)]
+        return Utils.unparse(declaration + body)
+
+    def f_memoize(args):
+        # wrap a user-defined function in a cache of its results:
+        function = args[0]
+        if not isinstance(function, Function):
+            return Error('(memoize) error: %s is not a user-defined function.' % function)
+        size = DEFAULT_MEMO_SIZE
+        if len(args) == 2:
+            size = args[1]
+            if not isinstance(size, int) or size < 1:
+                return Error('(memoize) error: cache size must be a positive integer, got %s.' % size)
+        # (memoizing a memoized function just changes its cache size)
+        if isinstance(function, MemoFunction):
+            function = function.function
+        return MemoFunction(function, size)
+
+    def f_memo_stats(arg):
+        # the (hits misses entries) of a memoized function's cache:
+        if not isinstance(arg[0], MemoFunction):
+            return Error('(memo-stats) error: %s is not a memoized function.' % arg[0])
+        return Utils.to_pairs([arg[0].hits, arg[0].misses, len(arg[0].cache)])
+
+    def f_memo_clear(arg):
+        # empty a memoized function's cache and reset its counters:
+        if not isinstance(arg[0], MemoFunction):
+            return Error('(memo-clear) error: %s is not a memoized function.' % arg[0])
+        arg[0].cache.clear()
+        arg[0].hits = arg[0].misses = 0
+
+    def f_delete(args, env):
         # delete symbols from our symbol table
+        symbols = env.interpreter.symbols
         for arg in args:
-            if arg not in SYMBOLS:
+            if arg not in symbols:
                 return Error('Error: %s not found in symbol table.' % arg)
 
         # now that we're sure that all our args are in the symbol table, delete them:
         for arg in args:
-            del SYMBOLS[arg]
+            del symbols[arg]
 
-    def f_read():
+    def f_read(args):
+        # (whatever was displayed before reading, like a prompt, is shown first)
+        STDOUT.flush()
         return input()
 
+# a table of IN-BUILT FUNCTIONS: maps each name (and alias) to the function that
+# implements it and the minimum and maximum (None for any) number of arguments
+# it takes. apply() dispatches through it, and map() and filter() use it to
+# verify functions. (kept apart from the symbol table to avoid letting user overload these)
+INBUILTFUNCTIONS = {
+    '+'         : (Functions.f_add, 0, None),
+    '-'         : (Functions.f_subtract, 1, None),
+    '*'         : (Functions.f_multiply, 1, None),
+    '/'         : (Functions.f_divide, 1, None),
+    '%'         : (Functions.f_modulus, 1, None),
+    'modulus'   : (Functions.f_modulus, 1, None),
+    '='         : (Functions.f_equal, 0, None),
+    'eq?'       : (Functions.f_equal, 0, None),
+    '!='        : (Functions.f_notequal, 0, None),
+    'neq?'      : (Functions.f_notequal, 0, None),
+    '>'         : (Functions.f_greater, 0, None),
+    'greater?'  : (Functions.f_greater, 0, None),
+    '<'         : (Functions.f_smaller, 0, None),
+    'smaller?'  : (Functions.f_smaller, 0, None),
+    '>='        : (Functions.f_greater_or_equal, 0, None),
+    'geq?'      : (Functions.f_greater_or_equal, 0, None),
+    '<='        : (Functions.f_smaller_or_equal, 0, None),
+    'leq?'      : (Functions.f_smaller_or_equal, 0, None),
+    'list'      : (Functions.make_list, 0, None),
+    'car'       : (Functions.f_car, 1, 1),
+    'cdr'       : (Functions.f_cdr, 1, 1),
+    'cadr'      : (Functions.f_cadr, 1, 1),
+    'caddr'     : (Functions.f_caddr, 1, 1),
+    'cadddr'    : (Functions.f_cadddr, 1, 1),
+    'caddddr'   : (Functions.f_caddddr, 1, 1),
+    'reverse'   : (Functions.f_reverse, 1, 1),
+    'append'    : (Functions.f_append, 0, None),
+    'cons'      : (Functions.f_cons, 2, 2),
+    'length'    : (Functions.f_length, 1, 1),
+    'at'        : (Functions.f_at, 2, None),
+    'even?'     : (Functions.iseven, 1, None),
+    'odd?'      : (Functions.isodd, 1, None),
+    'positive?' : (Functions.ispositive, 1, None),
+    'list?'     : (Functions.islist, 1, 1),
+    'null?'     : (Functions.isnull, 1, 1),
+    'vector'    : (Functions.make_vector, 0, None),
+    'vector?'   : (Functions.isvector, 1, 1),
+    'list->vector' : (Functions.f_list_to_vector, 1, 1),
+    'vector->list' : (Functions.f_vector_to_list, 1, 1),
+    'display'   : (Functions.display, 0, None),
+    'open-output-file' : (Functions.open_output_file, 1, 1),
+    'close-output-port' : (Functions.close_output_port, 1, 1),
+    'flush-output' : (Functions.flush_output, 0, 1),
+    'current-output-port' : (Functions.current_output_port, 0, 0),
+    'output-port?' : (Functions.isoutputport, 1, 1),
+    'with-output-to-string' : (Functions.with_output_to_string, 1, 1),
+    'map'       : (Functions.map, 2, None),
+    'filter'    : (Functions.filter, 2, 2),
+    'make-hash-table' : (Functions.make_hash_table, 0, 1),
+    'hash-ref'  : (Functions.hash_ref, 2, 3),
+    'hash-set!' : (Functions.hash_set, 3, 3),
+    'hash-remove!' : (Functions.hash_remove, 2, 2),
+    'hash-has-key?' : (Functions.hash_has_key, 2, 2),
+    'hash-count': (Functions.hash_count, 1, 1),
+    'hash-keys' : (Functions.hash_keys, 1, 1),
+    'hash->list': (Functions.hash_to_list, 1, 1),
+    'hash-table?' : (Functions.ishashtable, 1, 1),
+    'pmap'      : (Functions.pmap, 2, 3),
+    'pfilter'   : (Functions.pfilter, 2, 3),
+    'force'     : (Functions.force, 1, 1),
+    'stream-car': (Functions.f_car, 1, 1),
+    'stream-cdr': (Functions.stream_cdr, 1, 1),
+    'stream-null?' : (Functions.isnull, 1, 1),
+    'stream-map': (Functions.stream_map, 2, 2),
+    'stream-filter' : (Functions.stream_filter, 2, 2),
+    'stream-take' : (Functions.stream_take, 2, 2),
+    'stream->list' : (Functions.stream_to_list, 1, 2),
+    'range'     : (Functions.f_range, 1, 3),
+    'expand-optimized' : (Functions.f_expand_optimized, 1, 1),
+    'memoize'   : (Functions.f_memoize, 1, 2),
+    'memo-stats': (Functions.f_memo_stats, 1, 1),
+    'memo-clear': (Functions.f_memo_clear, 1, 1),
+    'read'      : (Functions.f_read, 0, 0),
+    'read-line' : (Functions.f_read, 0, 0),
+}
+
 # Function: a type for USER-DEFINED FUNCTIONS
 class Function:
-    def __init__(self, args, cmd):
+    def __init__(self, args, body, env, code=None, name=None):
         self.args = args
-        self.cmd = cmd
+        self.name = name # (None for lambdas)
+        self.body = body # list of parsed forms, evaluated in order
+        self.env = env # environment the function was defined in
+        # the compiled body (compiled here if whoever made the function didn't):
+        if code is None:
+            code = Compiler.compile_function(body, Compiler.scope_of(env).extend(args))
+        self.code = code
 
     def run(self, f_args):
+        # make sure non-tail calls haven't nested too deeply:
+        interpreter = self.env.interpreter
+        if interpreter.depth >= interpreter.max_depth:
+            return Error('Error: maximum recursion depth (%s) exceeded.' % interpreter.max_depth)
+
+        # run the function to completion; calls it makes in tail position come
+        # back as TailCalls and are run in this loop instead of recursing:
+        interpreter.depth += 1
+        try:
+            # every call (including tail calls) is a step:
+            budget = interpreter.budget
+            if budget is not None:
+                error = budget.step()
+                if error is not None:
+                    return error
+            return Function.finish(self.tailcall(f_args), budget)
+        except RecursionError:
+            # a level of nesting can take more python frames than
+            # FRAMES_PER_DEPTH allows for (like calls nested deep inside
+            # arithmetic), so python's own limit can come first:
+            return Error('Error: maximum recursion depth (%s) exceeded.' % interpreter.max_depth)
+        finally:
+            interpreter.depth -= 1
+
+    def finish(result, budget):
+        # run the tail calls result hands back, one after another, until one
+        # gives a value (taking a step from budget for each):
+        while isinstance(result, TailCall):
+            if budget is not None:
+                error = budget.step()
+                if error is not None:
+                    return error
+            result = result.function.tailcall(result.args)
+        return result
+
+    def tailcall(self, f_args):
         # error-checking:
         if len(f_args) != len(self.args):
             return Error('User-defined function runtime error: expected %s arguments, received %s.' % (len(self.args), len(f_args)))
 
-        # create local variable symbol table:
-        FUNCTIONVARS = {}
-        for arg, val in zip(self.args, f_args):
-            FUNCTIONVARS[arg] = val
-
-        # replace all occurrences of arguments in command as values and run them:
-        cmdcpy = self.cmd.replace(')', ' ) ').replace('(', ' ( ').split()
-        for t in range(len(cmdcpy)):
-            if cmdcpy[t] in FUNCTIONVARS:
-                cmdcpy[t] = str(FUNCTIONVARS[cmdcpy[t]])
-        cmdcpy = ' '.join(cmdcpy)
-
-        # execute cmd:
-        return evaluate(cmdcpy)
+        # run the body in a local frame binding each argument name to its value
+        # (a call in tail position is left to the caller):
+        return self.code(Environment(self.args, f_args, self.env))
 
     def __str__(self): # overload print() operator
-        return self.cmd
-
-class Utils:
-  def tokenize(cmd):
-    # first of all, strip cmd of any leading or trailing whitespace:
-    cmd = cmd.lstrip().rstrip()
-
-    # base case: if no spaces or parentheses (except outer), return cmd:
-    # note: cmd is returned as a list because the recursive case's extend()
-    #       only accepts lists
-    if cmd.count(' ') == 0 or cmd.count('(') == cmd.count(')') == 0:
-        return cmd.split()
-
-    # now we determine which comes first, a space or an open parentheses:
-    tokens = []
-    if cmd.find(' ') < cmd.find('('):
-        temp = cmd.split(' ', 1)
-        tokens.append(temp[0])
-        tokens.extend(Utils.tokenize(temp[1]))
-    else:
-        # otherwise, split by matching parentheses:
-        l = cmd.find('(')
-        r = l
-        ct = 0
-        for i in range(l+1, len(cmd)):
-            if cmd[i] == ')':
-                if ct == 0:
-                    r = i+1
-                    break
-                ct += 1
-            elif cmd[i] == '(':
-                ct -= 1
-
-        tokens.append(cmd[l:r]) # NOTE: WE ASSUME NOTHING IN cmd[:l]
-        tokens.extend(Utils.tokenize(cmd[r:]))
+        return ' '.join(Utils.unparse(node) for node in self.body)
+
+    def __getstate__(self):
+        # compiled code can't be pickled, so it's compiled again when needed:
+        state = dict(self.__dict__)
+        del state['code']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.code = self.compileLater
+
+    def compileLater(self, env):
+        # compile the body the first time the function is called (after
+        # unpickling, once the frames it closes over are all there):
+        self.code = Compiler.compile_function(self.body, Compiler.scope_of(self.env).extend(self.args))
+        return self.code(env)
+
+# MemoFunction: a user-defined function wrapped in a cache of its results, keyed
+#               on its arguments (so only for functions without side effects).
+#               once the cache holds size results, the least recently used go
+class MemoFunction(Function):
+    def __init__(self, function, size=DEFAULT_MEMO_SIZE):
+        self.function = function
+        self.args, self.body, self.env, self.code = function.args, function.body, function.env, function.code
+        self.name = function.name
+        self.size = size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # the cache isn't pickled (results are worked out again when needed):
+        state = Function.__getstate__(self)
+        del state['cache']
+        state['hits'] = state['misses'] = 0
+        return state
+
+    def __setstate__(self, state):
+        Function.__setstate__(self, state)
+        self.cache = collections.OrderedDict()
+
+    def tailcall(self, f_args):
+        # a memoized call has to finish before its result can be cached, so it
+        # is never handed back as a tail call (and it's already a level of
+        # nesting and a step, so the function underneath is run here instead
+        # of through its own run). arguments are compared by value and type,
+        # so (f 1) and (f 1.0) aren't the same call:
+        key = Utils.hashkey(f_args, exact=True)
+        if key is None:
+            # arguments that can't be hashed aren't cached:
+            return Function.finish(self.function.tailcall(f_args), self.env.interpreter.budget)
+        try:
+            result = self.cache[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return result
+
+        self.misses += 1
+        result = Function.finish(self.function.tailcall(f_args), self.env.interpreter.budget)
+        # errors aren't cached, in case whatever caused them goes away:
+        if not isinstance(result, Error):
+            self.cache[key] = result
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        return result
 
-    # remove any occurrences of '' from tokens:
-    return list(filter(lambda a: a != '', tokens))
+# TailCall: a call to a user-defined function made in tail position, handed back
+#           to Function.run so that tail calls don't grow the python stack
+class TailCall:
+    __slots__ = ('function', 'args')
 
-  def clean(cmd):
-      # cut everything after semicolon, if present:
-      if cmd.find(';') > 0:
-          cmd = cmd[:cmd.find(';')]
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
 
-      # deal with extra whitespaces:
-      return ' '.join(cmd.split())
+# HashTable: a table of values by key, where keys are compared by value (see
+#            Utils.hashkey). its elements (for map and filter) are its
+#            (key . value) pairs
+class HashTable:
+    def __init__(self, items=()):
+        self.entries = {} # hash key -> (key, value)
+        for key, value in items:
+            self.set(key, value)
+
+    def set(self, key, value):
+        # bind key to value, returning whether key could be a key:
+        hashkey = Utils.hashkey(key)
+        if hashkey is None:
+            return False
+        self.entries[hashkey] = (key, value)
+        return True
+
+    def __iter__(self):
+        for key, value in self.entries.values():
+            yield Pair(key, value)
+
+    def __str__(self):
+        return Utils.to_text(self)
+
+# Promise: a value that isn't worked out until it's first forced, and is
+#          remembered from then on (what delay and cons-stream make). thunk is
+#          a python function of no arguments returning the value
+class Promise:
+    __slots__ = ('thunk', 'value')
+
+    def __init__(self, thunk):
+        self.thunk = thunk
+        self.value = None
+
+    def force(self):
+        # errors aren't remembered, in case whatever caused them goes away:
+        if self.thunk is not None:
+            # (working out a promise is a step of the evaluation running in
+            # this thread, since a promise doesn't know its interpreter)
+            interpreter = RUNNING.interpreter
+            budget = interpreter.budget if interpreter is not None else None
+            if budget is not None:
+                error = budget.step()
+                if error is not None:
+                    return error
+            value = self.thunk()
+            if isinstance(value, Error):
+                return value
+            self.value, self.thunk = value, None
+        return self.value
+
+    def __str__(self):
+        return '#<promise>'
+
+    def __reduce__(self):
+        raise pickle.PicklingError('promises (and streams) can\'t be saved')
+
+# Port: where output goes (standard output, a file or a string). what's written
+#       is kept in a buffer and written out in one go when the buffer fills up or
+#       the port is flushed. stream is what it writes to (None for standard
+#       output, which is looked up when it's flushed)
+class Port:
+    __slots__ = ('stream', 'name', 'pending', 'size', '__weakref__')
+
+    def __init__(self, stream=None, name='stdout'):
+        self.stream = stream
+        self.name = name
+        self.pending = [] # text written since the last flush
+        self.size = 0 # (and how many characters it comes to)
+
+    def write(self, text):
+        self.pending.append(text)
+        self.size += len(text)
+        if self.size >= PORT_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.closed():
+            return
+        stream = sys.stdout if self.stream is None else self.stream
+        if len(self.pending) > 0:
+            stream.write(''.join(self.pending))
+            self.pending, self.size = [], 0
+        stream.flush()
+
+    def closed(self):
+        return self.stream is not None and self.stream.closed
+
+    def close(self):
+        # (standard output is only flushed)
+        self.flush()
+        if self.stream is not None:
+            self.stream.close()
+            OPEN_PORTS.discard(self)
+
+    def __del__(self):
+        # (a file port thrown away without being closed writes out what's left)
+        if self.stream is not None:
+            self.flush()
+
+    def __str__(self):
+        return '#<output-port %s>' % self.name
+
+    def __reduce__(self):
+        raise pickle.PicklingError('output ports can\'t be saved')
+
+STDOUT = Port() # standard output
+OPEN_PORTS = weakref.WeakSet() # file ports that haven't been closed
+
+def flushPorts():
+    # write out what's left in the buffers of file ports that were never closed:
+    for port in list(OPEN_PORTS):
+        port.flush()
+
+atexit.register(flushPorts)
+
+# Environment: a frame of local variables with a pointer to the frame it was
+#              created in. names are the names it binds, and values their values
+#              (at the same indices, which the compiler works out beforehand).
+#              the outermost frame of every chain binds nothing, and stands for
+#              the global symbols of the interpreter the chain belongs to
+class Environment:
+    __slots__ = ('names', 'values', 'parent', 'interpreter')
+
+    def __init__(self, names, values, parent=None, interpreter=None):
+        self.names = names
+        self.values = values
+        self.parent = parent
+        self.interpreter = parent.interpreter if parent is not None else interpreter
+
+# Cell: where the value of a global symbol is kept, so compiled code can find it
+#       once (when it's compiled) instead of looking it up every time it runs.
+#       the cell of a symbol that isn't defined holds the symbol itself (which
+#       is what it evaluates to)
+class Cell:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+# SymbolTable: an interpreter's global symbols, which keeps the cell of each one
+#              up to date as it's defined and deleted
+class SymbolTable(dict):
+    def __init__(self, symbols=()):
+        dict.__init__(self)
+        self.cells = {}
+        self.update(symbols)
+
+    def cell(self, name):
+        cell = self.cells.get(name)
+        if cell is None:
+            cell = self.cells[name] = Cell(self.get(name, name))
+        return cell
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name, value)
+        if name in self.cells:
+            self.cells[name].value = value
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        if name in self.cells:
+            self.cells[name].value = name
+
+    def update(self, symbols):
+        for name, value in dict(symbols).items():
+            self[name] = value
 
-  def isnumber(x):
-      if x.isnumeric(): return True
-      try:
-          float(x)
+class Utils:
+  def tokenize(source):
+      # split source into tokens in a single pass over it, yielding each one
+      # with the line and column it starts at. tokens are parentheses, quotes,
+      # string literals (with their double quotes) and atoms, and whitespace and
+      # comments are skipped:
+      i, line, linestart = 0, 1, 0
+      while i < len(source):
+          match = TOKEN.match(source, i)
+          token = match.group()
+          if match.lastgroup != 'space':
+              yield token, line, i - linestart + 1
+          # keep track of lines (whitespace and strings may span several):
+          newlines = token.count('\n')
+          if newlines > 0:
+              line += newlines
+              linestart = i + token.rfind('\n') + 1
+          i = match.end()
+
+  def parse(cmd):
+      # read source text into a list of top-level forms, where every form is
+      # either an atom or a python list of forms. 'x is read as (quote x):
+      stack = [[]]
+      opened = [] # (line, column) of each open parenthesis
+      quotes = [0] # number of quotes waiting for a form, for each open list
+      for token, line, column in Utils.tokenize(cmd):
+          if token == '(':
+              stack.append([])
+              opened.append((line, column))
+              quotes.append(0)
+              continue
+          elif token == "'":
+              quotes[-1] += 1
+              continue
+          elif token == ')':
+              # a closing parenthesis with nothing open:
+              if len(stack) == 1:
+                  return Error("Error: unexpected ')' at line %s, column %s." % (line, column))
+              # a quote with nothing after it:
+              if quotes.pop() > 0:
+                  return Error("Error: nothing to quote before line %s, column %s." % (line, column))
+              form = stack.pop()
+              opened.pop()
+          elif token.startswith('"'):
+              if Utils.unterminated(token):
+                  return Error('Error: unterminated string at line %s, column %s.' % (line, column))
+              form = Utils.read_string(token)
+          else:
+              form = Utils.atom(token)
+
+          # wrap the form in any quotes before it:
+          while quotes[-1] > 0:
+              form = [Symbol.intern('quote'), form]
+              quotes[-1] -= 1
+          stack[-1].append(form)
+
+      # make sure every parenthesis was closed:
+      if len(stack) != 1:
+          return Error("Error: missing ')' for the '(' at line %s, column %s." % opened[-1])
+      if quotes[0] > 0:
+          return Error('Error: nothing to quote at the end of the input.')
+      return stack[0]
+
+  def unterminated(token):
+      # whether a string token is missing its closing double quote
+      # (so it ends with an escaped one, or none at all):
+      if len(token) == 1 or not token.endswith('"'):
           return True
+      backslashes = len(token[1:-1]) - len(token[1:-1].rstrip('\\'))
+      return backslashes % 2 == 1
+
+  def read_string(token):
+      # the text of a string literal, without its double quotes and escapes:
+      return re.sub(r'\\(.)', lambda m: STRING_ESCAPES.get(m.group(1), m.group(1)), token[1:-1], flags=re.S)
+
+  def atom(token):
+      # booleans, the empty stream and numbers are read as values, anything
+      # else is a symbol:
+      if token in ('#t', '#f'):
+          return BOOLS[token == '#t']
+      if token == 'the-empty-stream':
+          return NIL
+      number = Utils.read_number(token)
+      if number is not None:
+          return number
+      return Symbol.intern(token)
+
+  def read_number(token):
+      # read token as an int, a fraction (like 1/3) or a float, or return None:
+      if NUMBER.fullmatch(token) is None:
+          return None
+      try:
+          return int(token)
       except ValueError:
-          return False
-
-  def attempt_int(x):
-      # error-checked int cast:
+          pass
+      if '/' in token:
+          try:
+              return Utils.simplify(Fraction(token))
+          except (ValueError, ZeroDivisionError):
+              return None
       try:
-          return int(x)
-      except:
-          # we're not returning an error here, other functions will take care of this:
-          print('Error: could not perform int conversion.')
-
-  def attempt_float(x):
-      # error-checked float cast:
+          return float(token)
+      except ValueError:
+          return None
+
+  def to_pairs(elements, tail=NIL):
+      # build a list (a chain of pairs ending in tail) from a python list:
+      for element in reversed(elements):
+          tail = Pair(element, tail)
+      return tail
+
+  def output():
+      # the current output port of the interpreter whose evaluation is running
+      # in this thread (or standard output, outside of any):
+      interpreter = RUNNING.interpreter
+      return interpreter.output if interpreter is not None else STDOUT
+
+  def unbound(symbol, env):
+      # whether a global name has no value in env's interpreter (in-built
+      # function names are bound to themselves):
+      return symbol not in env.interpreter.symbols and symbol not in INBUILTFUNCTIONS
+
+  def iscompound(x):
+      # lists, vectors and hash tables are printed element by element:
+      return isinstance(x, (Pair, Nil, list, HashTable))
+
+  def to_text(x):
+      # the text x is displayed as. lists, vectors and hash tables are written
+      # into one list of parts (and joined once) instead of piece by piece:
+      if not Utils.iscompound(x):
+          return str(x)
+      parts = []
+      Utils.write_compound(x, parts)
+      return ''.join(parts)
+
+  def write_compound(x, parts):
+      # vectors are written with a leading '#', and hash tables as '#hash' and
+      # a list of their (key . value) pairs:
+      if isinstance(x, list):
+          parts.append('#')
+          elements, tail = x, NIL
+      elif isinstance(x, HashTable):
+          parts.append('#hash')
+          elements, tail = list(x), NIL
+      else:
+          # collect the elements of the chain of pairs:
+          elements, tail = [], x
+          while isinstance(tail, Pair):
+              elements.append(tail.car)
+              tail = tail.cdr
+
+      parts.append('(')
+      for i in range(len(elements)):
+          if i > 0: parts.append(', ')
+          if Utils.iscompound(elements[i]):
+              Utils.write_compound(elements[i], parts)
+          else: parts.append(str(elements[i]))
+      # a list that doesn't end in NIL (like (cons 1 2)) shows its last cdr:
+      if tail is not NIL:
+          parts.append(' . ')
+          if Utils.iscompound(tail):
+              Utils.write_compound(tail, parts)
+          else: parts.append(str(tail))
+      parts.append(')')
+
+  def hashkey(key, exact=False):
+      # what key is stored under in a hash table, so keys are compared by value:
+      # symbols are kept apart from strings with the same name, and lists and
+      # vectors are compared by their elements. keys that can't be hashed give
+      # None. exact keys keep numbers of different types apart too (so 1 and
+      # 1.0 aren't the same):
+      if isinstance(key, Symbol):
+          return (Symbol, str(key))
+      if isinstance(key, (Pair, Nil, list)):
+          elements = [Utils.hashkey(element, exact) for element in key]
+          if None in elements:
+              return None
+          if isinstance(key, list):
+              return (list, tuple(elements))
+          # (improper lists end in something other than NIL)
+          tail = key
+          while isinstance(tail, Pair):
+              tail = tail.cdr
+          tail = Utils.hashkey(tail, exact) if tail is not NIL else ()
+          return None if tail is None else (Pair, tuple(elements), tail)
       try:
-          return float(x)
-      except:
-          # we're not returning an error here, other functions will take care of this:
-          print('Error: could not perform float conversion.')
+          hash(key)
+      except TypeError:
+          return None
+      return (type(key), key) if exact else key
+
+  def isfunction(x):
+      # user-defined functions are values, and in-built ones are referred to by name:
+      return isinstance(x, Function) or (isinstance(x, str) and x in INBUILTFUNCTIONS)
+
+  def issequence(x):
+      # lists (chains of pairs), the empty list and vectors can all be iterated over:
+      return isinstance(x, (Pair, Nil, list))
+
+  def nth(sequence, n):
+      # the element at index n of a list or vector (raises an exception if there's none):
+      if isinstance(sequence, list):
+          return sequence[n]
+      if not isinstance(n, int) or n < 0:
+          raise IndexError(n)
+      for element in sequence:
+          if n == 0:
+              return element
+          n -= 1
+      raise IndexError(n)
+
+  def then(value, function):
+      # function applied to value, unless value is an error:
+      if isinstance(value, Error):
+          return value
+      return function(value)
+
+  def caller(function, nargs):
+      # a python function calling function (user-defined or in-built) with a
+      # list of nargs arguments, so calling it many times doesn't have to look
+      # it up (or check its arguments are the right number) every time:
+      if isinstance(function, Function):
+          return function.run
+      builtin, min_args, max_args = INBUILTFUNCTIONS[function]
+      error = Utils.arity_error(function, nargs, min_args, max_args)
+      if error is not None:
+          return lambda args: error
+      # (while profiling, calls go through here so the profiler can tell them
+      # apart from the in-built functions' calls to each other)
+      if sys.getprofile() is not None:
+          return lambda args: builtin(args)
+      return builtin
+
+  def arity_error(name, nargs, min_args, max_args):
+      # the error for calling in-built function name with nargs arguments, or
+      # None if that's the right number:
+      if nargs >= min_args and (max_args is None or nargs <= max_args):
+          return None
+      if min_args == max_args:
+          expected = '%s argument%s' % (min_args, '' if min_args == 1 else 's')
+      elif nargs < min_args:
+          expected = 'at least %s argument%s' % (min_args, '' if min_args == 1 else 's')
+      else:
+          expected = 'at most %s argument%s' % (max_args, '' if max_args == 1 else 's')
+      return Error('(%s) error: expected %s, %s provided.' % (name, expected, nargs))
+
+  def unparse(form):
+      # turn a parsed form back into source text:
+      if isinstance(form, list):
+          return '(' + ' '.join(Utils.unparse(f) for f in form) + ')'
+      if isinstance(form, str) and not isinstance(form, Symbol):
+          return '"%s"' % form.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\t', '\\t')
+      if form is NIL: # (only read from the-empty-stream)
+          return 'the-empty-stream'
+      return str(form)
+
+  def to_datum(form):
+      # turn a parsed form into the value it quotes (so its lists become real lists):
+      if isinstance(form, list):
+          return Utils.to_pairs([Utils.to_datum(f) for f in form])
+      return form
+
+  def to_form(value, frames=frozenset()):
+      # a parsed form that evaluates back to value (so values can be sent
+      # between interpreters). functions are rebuilt from their source, inside
+      # letrec-forms rebinding the local variables they close over (apart from
+      # the frames in frames, which enclosing forms already rebind):
+      if isinstance(value, Function):
+          form = [Symbol.intern('lambda'), list(value.args)] + list(value.body)
+          chain, env = [], value.env
+          while env.parent is not None and env not in frames:
+              chain.append(env)
+              env = env.parent
+          frames = frames | frozenset(chain)
+          for frame in chain:
+              bindings = [[name, Utils.to_form(v, frames)] for name, v in zip(frame.names, frame.values)]
+              form = [Symbol.intern('letrec'), bindings, form]
+          if isinstance(value, MemoFunction):
+              form = [Symbol.intern('memoize'), form, value.size]
+          return form
+      if isinstance(value, (Pair, Nil)):
+          elements = [Symbol.intern('list')]
+          while isinstance(value, Pair):
+              elements.append(Utils.to_form(value.car, frames))
+              value = value.cdr
+          if value is NIL:
+              return elements
+          return [Symbol.intern('append'), elements, Utils.to_form(value, frames)]
+      if isinstance(value, list):
+          return [Symbol.intern('vector')] + [Utils.to_form(v, frames) for v in value]
+      if isinstance(value, Symbol):
+          return [Symbol.intern('quote'), value]
+      if value is None: # (what an if-statement without an 'else' gives)
+          return [Symbol.intern('if'), BOOLS[False], BOOLS[False]]
+      # numbers, booleans and strings are their own forms:
+      return value
+
+  def to_number(x):
+      # numbers are returned as they are, and text is read as a number if it is one
+      # (anything else gives None):
+      if isinstance(x, (int, float, Fraction)):
+          return x
+      if isinstance(x, str):
+          return Utils.read_number(x)
+      return None
+
+  def divide(x, y):
+      # keep integer division exact when it divides evenly:
+      if isinstance(x, int) and isinstance(y, int) and x % y == 0:
+          return x // y
+      return x / y
+
+  def numeric(column):
+      # the types of the elements of a python list, if they're all numbers
+      # (or None if any isn't):
+      kinds = set(map(type, column))
+      if kinds <= NUMERIC_TYPES:
+          return kinds
+      return None
+
+  def bulk(name, columns):
+      # apply arithmetic operator name element by element across columns (python
+      # lists of the same length) in one pass over each, or return None if any
+      # of them holds something that isn't a number:
+      kinds = set()
+      for column in columns:
+          column_kinds = Utils.numeric(column)
+          if column_kinds is None:
+              return None
+          kinds |= column_kinds
+      if name == '/' and any(0 in column for column in columns[1:]):
+          return Error('(/) error: division by zero.')
+
+      if numpy is not None and kinds == {float}:
+          arrays = [numpy.asarray(column, dtype=float) for column in columns]
+          result = functools.reduce(getattr(numpy, NUMPY_OPERATORS[name]), arrays).tolist()
+      else:
+          function = BULK_OPERATORS[name]
+          result = functools.reduce(lambda x, y: list(map(function, x, y)), columns[1:], list(columns[0]))
+
+      # adding, subtracting and multiplying integers can only give integers:
+      if kinds == {int} and name != '/':
+          return result
+      return [Utils.simplify(x) for x in result]
+
+  def simplify(x):
+      # integral results are kept (and shown) as integers:
+      if isinstance(x, float) and x.is_integer():
+          return int(x)
+      if isinstance(x, Fraction) and x.denominator == 1:
+          return x.numerator
+      return x
 
   def unbalanced(cmd):
-      return cmd.count('(') != cmd.count(')')
-
-def processSpecial(cmd):
-    if cmd.startswith('define '):
-        Functions.f_define(cmd[7:])
-    elif cmd.startswith('if '):
-        return Functions.handle_if(cmd[3:])
-    elif cmd.startswith('or '):
-        return Functions.handle_or(cmd[3:])
-    elif cmd.startswith('and '):
-        return Functions.handle_and(cmd[4:])
-    elif cmd.startswith('lambda '):
-        return Functions.handle_lambda(cmd[7:])
-
-def runCmd(cmd):
-    # split by whitespace:
-    cmd = cmd.split()
+      # whether cmd has parentheses (or a string) left open:
+      depth = 0
+      for token, line, column in Utils.tokenize(cmd):
+          if token == '(':
+              depth += 1
+          elif token == ')':
+              depth -= 1
+          elif token.startswith('"') and Utils.unterminated(token):
+              return True
+      return depth > 0
+
+NUMERIC_TYPES = {int, float, Fraction} # the types numbers are read as
+# tables of the in-built arithmetic operators and numeric predicates that can be
+# applied to whole vectors of numbers at once (see Utils.bulk), and the numpy
+# functions used for vectors of floats:
+BULK_OPERATORS = {'+' : operator.add, '-' : operator.sub, '*' : operator.mul, '/' : Utils.divide}
+BULK_PREDICATES = {
+    'even?'     : lambda x: x % 2 == 0,
+    'odd?'      : lambda x: x % 2 != 0,
+    'positive?' : lambda x: x > 0,
+}
+NUMPY_OPERATORS = {'+' : 'add', '-' : 'subtract', '*' : 'multiply', '/' : 'true_divide'}
+# the in-built functions whose results depend only on their arguments, so calls to
+# them with constant arguments can be worked out once (see Compiler.optimize):
+PURE_FUNCTIONS = {
+    '+', '-', '*', '/', '%', 'modulus', '=', 'eq?', '!=', 'neq?', '>', 'greater?',
+    '<', 'smaller?', '>=', 'geq?', '<=', 'leq?', 'list',
+}
+
+# Scope: what the compiler knows about the names a form will be able to see: the
+#        names bound by each local frame it will run in (innermost first), and
+#        the interpreter whose global symbols it will use (if it's known)
+class Scope:
+    def __init__(self, frames=(), interpreter=None):
+        self.frames = frames
+        self.interpreter = interpreter
+
+    def __contains__(self, name):
+        return any(name in frame for frame in self.frames)
+
+    def extend(self, names):
+        # the scope inside a new frame binding names:
+        return Scope((tuple(names),) + self.frames, self.interpreter)
+
+    def address(self, name):
+        # how many frames out name is bound, and its index in that frame's
+        # values (or None if it isn't local). when a frame binds a name twice,
+        # the last one wins:
+        for depth, frame in enumerate(self.frames):
+            if name in frame:
+                return depth, len(frame) - 1 - frame[::-1].index(name)
+        return None
 
+# Compiler: turns parsed forms into python closures once, so running a form
+#           doesn't have to look at (or re-tokenize) it again. each closure takes
+#           the environment to run in and returns the form's value.
+#           scope is the Scope of the names a form can see, and tail is whether
+#           the form is in tail position (where calls to user-defined functions
+#           are handed back as TailCalls instead of being run)
+class Compiler:
+    def compile(node, scope=Scope(), tail=False):
+        # symbols are looked up when the closure runs:
+        if isinstance(node, Symbol):
+            return Compiler.compile_symbol(node, scope)
+
+        # numbers and booleans evaluate to themselves:
+        if not isinstance(node, list):
+            return lambda env: node
+
+        # an empty form has nothing to evaluate:
+        if len(node) == 0:
+            return lambda env: None
+
+        # special words (define, if, lambda, etc.) compile their operands themselves:
+        if isinstance(node[0], Symbol) and node[0] in SPECIAL_WORDS:
+            return SPECIAL_WORDS[node[0]](node[1:], scope, tail)
+
+        return Compiler.compile_apply(node, scope, tail)
+
+    def compile_symbol(symbol, scope):
+        # local names are found at the depth and index worked out now:
+        address = scope.address(symbol)
+        if address is not None:
+            depth, index = address
+            if depth == 0:
+                return lambda env: env.values[index]
+            if depth == 1:
+                return lambda env: env.parent.values[index]
+            def run(env):
+                for i in range(depth):
+                    env = env.parent
+                return env.values[index]
+            return run
+
+        # anything else can only be global (or unbound, so it's its own value),
+        # and is kept in a cell of the interpreter's symbol table:
+        if scope.interpreter is not None:
+            cell = scope.interpreter.symbols.cell(symbol)
+            return lambda env: cell.value
+        return lambda env: env.interpreter.symbols.get(symbol, symbol)
+
+    def compile_apply(node, scope, tail):
+        head = node[0]
+        argcodes = [Compiler.compile(n, scope) for n in node[1:]]
+
+        # in-built function names can't be overloaded by global symbols (only
+        # by local ones), so in-built functions are found once, here:
+        if isinstance(head, Symbol) and head in INBUILTFUNCTIONS and head not in scope:
+            return Compiler.compile_builtin(head, argcodes)
+
+        headcode = Compiler.compile(head, scope)
+        # a global name that isn't bound evaluates to itself, so calling one is
+        # caught here (a symbol that's the value of a bound name, like one a
+        # quote gave, isn't unbound):
+        unbound = isinstance(head, Symbol) and head not in scope and head != '$SYMBOLS'
+        def run(env):
+            function = headcode(env)
+            if isinstance(function, Error):
+                return function
+            if unbound and function is head and Utils.unbound(head, env):
+                if len(argcodes) == 0:
+                    return Error('Error: symbol %s not found.' % head)
+                return Error('Error: function %s not found.' % head)
+            args = []
+            for code in argcodes:
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+                args.append(value)
+
+            # user-defined functions are run here (or handed back, in tail position):
+            if isinstance(function, Function) and (len(args) > 0 or len(function.args) == 0):
+                if tail:
+                    return TailCall(function, args)
+                return function.run(args)
+
+            # and anything else is run as a command:
+            return runCmd([function] + args, env)
+        return run
+
+    def compile_builtin(name, argcodes):
+        function, min_args, max_args = INBUILTFUNCTIONS[name]
+
+        # the number of arguments is known now, so it's checked now:
+        error = Utils.arity_error(name, len(argcodes), min_args, max_args)
+        if error is not None:
+            return lambda env: error
+
+        # (the common one- and two-argument cases skip the loop)
+        if len(argcodes) == 1:
+            a = argcodes[0]
+            def run(env):
+                x = a(env)
+                if isinstance(x, Error):
+                    return x
+                return function([x])
+            return run
+
+        if len(argcodes) == 2:
+            a, b = argcodes
+            def run(env):
+                x = a(env)
+                if isinstance(x, Error):
+                    return x
+                y = b(env)
+                if isinstance(y, Error):
+                    return y
+                return function([x, y])
+            return run
+
+        def run(env):
+            args = []
+            for code in argcodes:
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+                args.append(value)
+            return function(args)
+        return run
+
+    def compile_body(body, scope):
+        # a sequence of forms whose value is the value of the last one (which
+        # is in tail position):
+        if len(body) == 0:
+            return lambda env: None
+        codes = [Compiler.compile(node, scope) for node in body[:-1]]
+        last = Compiler.compile(body[-1], scope, True)
+        if len(codes) == 0:
+            return last
+
+        def run(env):
+            for code in codes:
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+            return last(env)
+        return run
+
+    def compile_function(body, scope):
+        # the body of a function, optimized first (unless that's turned off):
+        if OPTIMIZE:
+            body = [Compiler.optimize(node, scope) for node in body]
+        return Compiler.compile_body(body, scope)
+
+    def compile_define(args, scope, tail):
+        # make sure we have a name and a value:
+        if len(args) < 2:
+            error = Error('(define) error: expected 2 arguments, %s provided.' % len(args))
+            return lambda env: error
+
+        if isinstance(args[0], list):
+            # then this is a function definition:
+            # (so '(square x) (* x x)' arrives as [square, x] and [*, x, x])
+            return Compiler.compile_definefunction(args, scope)
+
+        name = args[0]
+        valuecode = Compiler.compile(args[1], scope)
+        def run(env):
+            value = valuecode(env)
+            if isinstance(value, Error):
+                return value
+            env.interpreter.symbols[name] = value
+        return run
+
+    def compile_definefunction(args, scope, memo=False):
+        # args[0] is the declaration and the rest is the definition:
+        if len(args[0]) == 0 or not isinstance(args[0][0], Symbol):
+            error = Error('(define) error: expected a function name.')
+            return lambda env: error
+        name, params, body = args[0][0], args[0][1:], args[1:]
+        code = Compiler.compile_function(body, scope.extend(params))
+
+        # create a new Function object for this function, closing over the
+        # environment it was defined in:
+        def run(env):
+            function = Function(params, body, env, code, name)
+            env.interpreter.symbols[name] = MemoFunction(function) if memo else function
+        return run
+
+    def compile_definememo(args, scope, tail):
+        # like defining a function, but its results are cached (see MemoFunction):
+        if len(args) < 2 or not isinstance(args[0], list):
+            error = Error('(define-memo) error: expected a function declaration and definition.')
+            return lambda env: error
+        return Compiler.compile_definefunction(args, scope, True)
+
+    def compile_if(args, scope, tail):
+        # make sure we only have 2 or 3 args:
+        if len(args) < 2:
+            error = Error('If-statement error: not enough arguments! (%s provided.)' %len(args))
+            return lambda env: error
+        if len(args) > 3:
+            error = Error('If-statement error: too many arguments! (%s provided).' %len(args))
+            return lambda env: error
+
+        # both branches are in tail position if the if-statement is:
+        test = Compiler.compile(args[0], scope)
+        then = Compiler.compile(args[1], scope, tail)
+        otherwise = Compiler.compile(args[2], scope, tail) if len(args) == 3 else None
+        true = BOOLS[True]
+
+        def run(env):
+            value = test(env)
+            if isinstance(value, Error):
+                return value
+            if value == true: # if the statement is true
+                return then(env)
+            elif otherwise is not None: # if an 'else' statement was provided
+                return otherwise(env)
+        return run
+
+    def compile_or(args, scope, tail):
+        # if no tokens were given, OR is false:
+        if len(args) == 0:
+            return lambda env: BOOLS[False]
+        codes = [Compiler.compile(node, scope) for node in args[:-1]]
+        last = Compiler.compile(args[-1], scope, tail)
+        true = BOOLS[True]
+
+        def run(env):
+            # if any tokens (but the last) evaluate to true, then OR is true:
+            for code in codes:
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+                if value == true:
+                    return true
+            # otherwise, OR is whatever the last token (in tail position) is:
+            return last(env)
+        return run
+
+    def compile_and(args, scope, tail):
+        # if no tokens were given, AND is true:
+        if len(args) == 0:
+            return lambda env: BOOLS[True]
+        codes = [Compiler.compile(node, scope) for node in args[:-1]]
+        last = Compiler.compile(args[-1], scope, tail)
+        false = BOOLS[False]
+
+        def run(env):
+            # if any tokens (but the last) evaluate to false, then AND is false:
+            for code in codes:
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+                if value == false:
+                    return false
+            # otherwise, AND is whatever the last token (in tail position) is:
+            return last(env)
+        return run
+
+    def compile_lambda(args, scope, tail):
+        # a lambda is just a function that isn't given a name:
+        if len(args) == 0 or not isinstance(args[0], list):
+            error = Error('(lambda) error: expected a list of arguments.')
+            return lambda env: error
+        params, body = args[0], args[1:]
+        code = Compiler.compile_function(body, scope.extend(params))
+        return lambda env: Function(params, body, env, code)
+
+    def compile_bindings(word, bindings):
+        # split the bindings of a let-form ('((x 1) (y 2))') into names and
+        # values, or return an error if they aren't a list of (name value) pairs:
+        if not isinstance(bindings, list):
+            return Error('(%s) error: expected a list of bindings.' % word)
+        for binding in bindings:
+            if not isinstance(binding, list) or len(binding) != 2 or not isinstance(binding[0], Symbol):
+                return Error('(%s) error: bad binding %s.' % (word, Utils.unparse(binding)))
+        return [b[0] for b in bindings], [b[1] for b in bindings]
+
+    def compile_let(args, scope, tail):
+        # a named let ('(let loop ((i 0)) ...)') is a loop:
+        if len(args) > 0 and isinstance(args[0], Symbol):
+            return Compiler.compile_namedlet(args, scope, tail)
+
+        # make sure we have bindings (and a body):
+        if len(args) < 2:
+            error = Error('(let) error: expected bindings and a body.')
+            return lambda env: error
+        bindings = Compiler.compile_bindings('let', args[0])
+        if isinstance(bindings, Error):
+            return lambda env: bindings
+        names, values = bindings
+
+        # the values are evaluated outside the new frame, so they can't see
+        # each other:
+        valuecodes = [Compiler.compile(node, scope) for node in values]
+        body = Compiler.compile_body(args[1:], scope.extend(names))
+        body = Compiler.compile_tail(body, tail)
+
+        def run(env):
+            values = []
+            for code in valuecodes:
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+                values.append(value)
+            return body(Environment(names, values, env))
+        return run
+
+    def compile_letstar(args, scope, tail):
+        # make sure we have bindings (and a body):
+        if len(args) < 2:
+            error = Error('(let*) error: expected bindings and a body.')
+            return lambda env: error
+        bindings = Compiler.compile_bindings('let*', args[0])
+        if isinstance(bindings, Error):
+            return lambda env: bindings
+        names, values = bindings
+
+        # each value can see the names bound before it, so each binding gets
+        # a frame of its own (inside the one before):
+        valuecodes = []
+        frames = [(name,) for name in names]
+        for frame, node in zip(frames, values):
+            valuecodes.append(Compiler.compile(node, scope))
+            scope = scope.extend(frame)
+        body = Compiler.compile_body(args[1:], scope)
+        body = Compiler.compile_tail(body, tail)
+
+        def run(env):
+            for frame, code in zip(frames, valuecodes):
+                value = code(env)
+                if isinstance(value, Error):
+                    return value
+                env = Environment(frame, [value], env)
+            return body(env)
+        return run
+
+    def compile_letrec(args, scope, tail):
+        # make sure we have bindings (and a body):
+        if len(args) < 2:
+            error = Error('(letrec) error: expected bindings and a body.')
+            return lambda env: error
+        bindings = Compiler.compile_bindings('letrec', args[0])
+        if isinstance(bindings, Error):
+            return lambda env: bindings
+        names, values = bindings
+
+        # the values are evaluated inside the new frame (in order), so functions
+        # bound there can call themselves and each other:
+        # (until a name's value is worked out, it's unbound, so it evaluates
+        # to itself)
+        scope = scope.extend(names)
+        valuecodes = [Compiler.compile(node, scope) for node in values]
+        body = Compiler.compile_body(args[1:], scope)
+        body = Compiler.compile_tail(body, tail)
+
+        def run(env):
+            frame = Environment(names, list(names), env)
+            for i, code in enumerate(valuecodes):
+                value = code(frame)
+                if isinstance(value, Error):
+                    return value
+                frame.values[i] = value
+            return body(frame)
+        return run
+
+    def compile_namedlet(args, scope, tail):
+        # make sure we have a name, bindings and a body:
+        if len(args) < 3:
+            error = Error('(let) error: expected a name, bindings and a body.')
+            return lambda env: error
+        name = args[0]
+        bindings = Compiler.compile_bindings('let', args[1])
+        if isinstance(bindings, Error):
+            return lambda env: bindings
+        params, values = bindings
+
+        # the body is a function bound to name (in a frame of its own), so
+        # calling name in tail position loops without growing the stack:
+        valuecodes = [Compiler.compile(node, scope) for node in values]
+        body = args[2:]
+        code = Compiler.compile_function(body, scope.extend([name]).extend(params))
+
+        def run(env):
+            args = []
+            for valuecode in valuecodes:
+                value = valuecode(env)
+                if isinstance(value, Error):
+                    return value
+                args.append(value)
+            frame = Environment((name,), [None], env)
+            function = frame.values[0] = Function(params, body, frame, code, name)
+            if tail:
+                return TailCall(function, args)
+            return function.run(args)
+        return run
+
+    def compile_tail(code, tail):
+        # a body compiled in tail position may hand back a TailCall; if the form
+        # it belongs to isn't in tail position, the call has to be run here:
+        if tail:
+            return code
+        def run(env):
+            result = code(env)
+            if isinstance(result, TailCall):
+                return result.function.run(result.args)
+            return result
+        return run
+
+    def compile_profile(args, scope, tail):
+        # make sure we have a form to profile (and maybe the report's format):
+        if len(args) not in (1, 2) or (len(args) == 2 and args[1] not in ('text', 'json')):
+            error = Error("(profile) error: expected a form, and optionally 'text' or 'json'.")
+            return lambda env: error
+        form = args[1] if len(args) == 2 else 'text'
+
+        # the form isn't in tail position, so its calls finish while profiled:
+        code = Compiler.compile(args[0], scope)
+        def run(env):
+            # (profiling inside profiling just runs the form)
+            if sys.getprofile() is not None:
+                return code(env)
+            profiler = Profiler()
+            profiler.start()
+            try:
+                value = code(env)
+            finally:
+                profiler.stop()
+            env.interpreter.output.write(profiler.report(form) + '\n')
+            return value
+        return run
+
+    def compile_delay(args, scope, tail):
+        # make sure exactly one form is delayed:
+        if len(args) != 1:
+            error = Error('(delay) error: expected 1 argument, %s provided.' % len(args))
+            return lambda env: error
+        # (the form isn't in tail position, since it's run by force)
+        code = Compiler.compile(args[0], scope)
+        return lambda env: Promise(lambda: code(env))
+
+    def compile_consstream(args, scope, tail):
+        # a pair of a value and a promise of the rest of the stream:
+        if len(args) != 2:
+            error = Error('(cons-stream) error: expected 2 arguments, %s provided.' % len(args))
+            return lambda env: error
+        first = Compiler.compile(args[0], scope)
+        rest = Compiler.compile(args[1], scope)
+
+        def run(env):
+            value = first(env)
+            if isinstance(value, Error):
+                return value
+            return Pair(value, Promise(lambda: rest(env)))
+        return run
+
+    def compile_quote(args, scope, tail):
+        # make sure exactly one form is quoted:
+        if len(args) != 1:
+            error = Error('(quote) error: expected 1 argument, %s provided.' % len(args))
+            return lambda env: error
+        value = Utils.to_datum(args[0])
+        return lambda env: value
+
+    def compile_saveimage(args, scope, tail):
+        # make sure exactly one file name is given:
+        if len(args) != 1:
+            error = Error('(save-image) error: expected 1 argument, %s provided.' % len(args))
+            return lambda env: error
+        pathcode = Compiler.compile(args[0], scope)
+
+        def run(env):
+            path = pathcode(env)
+            if isinstance(path, Error):
+                return path
+            if not isinstance(path, str) or isinstance(path, Symbol):
+                return Error('(save-image) error: %s is not a file name.' % path)
+            try:
+                env.interpreter.saveImage(path)
+            except OSError as e:
+                return Error('(save-image) error: could not write %s: %s' % (path, e.strerror))
+            except pickle.PicklingError as e:
+                return Error('(save-image) error: %s' % e)
+        return run
+
+    def compile_del(args, scope, tail):
+        return lambda env: Functions.f_delete(args, env)
+
+    def optimize(node, scope=Scope()):
+        # return node with the parts that are the same every time it runs worked
+        # out now: calls to pure in-built functions with constant arguments are
+        # replaced by their results, if-statements with a constant test by the
+        # branch it picks, and constant operands of and/or are dropped (or cut
+        # everything after them short):
+        if not isinstance(node, list) or len(node) == 0:
+            return node
+        head = node[0]
+        if isinstance(head, Symbol) and head in SPECIAL_WORDS:
+            optimizer = OPTIMIZERS.get(head)
+            return node if optimizer is None else optimizer(node, scope)
+
+        node = [head] + [Compiler.optimize(n, scope) for n in node[1:]]
+        if isinstance(head, Symbol) and head in PURE_FUNCTIONS and head not in scope:
+            if all(Compiler.isconstant(n) for n in node[1:]):
+                function, min_args, max_args = INBUILTFUNCTIONS[head]
+                args = [Compiler.constant_value(n) for n in node[1:]]
+                if Utils.arity_error(head, len(args), min_args, max_args) is None:
+                    value = function(args)
+                    # (errors are left for when the call runs)
+                    if not isinstance(value, Error):
+                        return Compiler.constant_form(value, node)
+        elif isinstance(head, list):
+            node[0] = Compiler.optimize(head, scope)
+        return node
+
+    def optimize_if(node, scope):
+        node = [node[0]] + [Compiler.optimize(n, scope) for n in node[1:]]
+        if len(node) not in (3, 4) or not Compiler.isconstant(node[1]):
+            return node
+        if Compiler.constant_value(node[1]) == BOOLS[True]:
+            return node[2]
+        if len(node) == 4:
+            return node[3]
+        return node
+
+    def optimize_andor(node, scope):
+        # for and, a constant #f cuts the rest short (and other constants can be
+        # dropped); for or, the same goes for a constant #t. the last operand
+        # is kept either way, since it's the value:
+        stop = BOOLS[node[0] == 'or']
+        operands = [Compiler.optimize(n, scope) for n in node[1:]]
+        kept = []
+        for i, operand in enumerate(operands):
+            if Compiler.isconstant(operand) and i < len(operands) - 1:
+                if Compiler.constant_value(operand) == stop:
+                    kept.append(operand)
+                    break
+                continue
+            kept.append(operand)
+        if len(kept) == 0:
+            return BOOLS[node[0] == 'and']
+        if len(kept) == 1:
+            return kept[0]
+        return [node[0]] + kept
+
+    def optimize_lambda(node, scope):
+        if len(node) < 2 or not isinstance(node[1], list):
+            return node
+        scope = scope.extend(node[1])
+        return node[:2] + [Compiler.optimize(n, scope) for n in node[2:]]
+
+    def optimize_define(node, scope):
+        if len(node) < 3:
+            return node
+        if isinstance(node[1], list):
+            return node[:2] + [Compiler.optimize(n, scope.extend(node[1][1:])) for n in node[2:]]
+        return node[:2] + [Compiler.optimize(n, scope) for n in node[2:]]
+
+    def optimize_let(node, scope):
+        # (only well-formed let-forms are optimized, and the rest are left for
+        # their compilers to complain about)
+        named = len(node) > 1 and isinstance(node[1], Symbol) and node[0] == 'let'
+        bindings = node[2] if named else node[1] if len(node) > 1 else None
+        if not isinstance(bindings, list) or not all(isinstance(b, list) and len(b) == 2 and isinstance(b[0], Symbol) for b in bindings):
+            return node
+        names = [b[0] for b in bindings]
+
+        # the values see what their compilers let them see:
+        inner = scope.extend(names)
+        optimized = []
+        for name, value in bindings:
+            if node[0] == 'letrec':
+                value = Compiler.optimize(value, inner)
+            else:
+                value = Compiler.optimize(value, scope)
+            if node[0] == 'let*':
+                scope = scope.extend([name])
+            optimized.append([name, value])
+        if node[0] == 'let*':
+            inner = scope
+        if named:
+            inner = scope.extend([node[1]]).extend(names)
+            return node[:2] + [optimized] + [Compiler.optimize(n, inner) for n in node[3:]]
+        return [node[0], optimized] + [Compiler.optimize(n, inner) for n in node[2:]]
+
+    def isconstant(node):
+        # numbers, booleans, strings and quoted forms evaluate to the same
+        # thing every time:
+        if isinstance(node, list):
+            return len(node) == 2 and node[0] == 'quote' and isinstance(node[0], Symbol)
+        return not isinstance(node, Symbol)
+
+    def constant_value(node):
+        if isinstance(node, list):
+            return Utils.to_datum(node[1])
+        return node
+
+    def constant_form(value, node):
+        # a constant form that evaluates to value (or node, if there isn't one):
+        if isinstance(value, (Pair, Nil, Symbol)):
+            datum = Compiler.datum_form(value)
+            return node if datum is None else [Symbol.intern('quote'), datum]
+        if isinstance(value, (int, float, Fraction, str, Boolean)):
+            return value
+        return node
+
+    def datum_form(value):
+        # the form quoting value reads as (so lists become python lists), or
+        # None if there isn't one:
+        if isinstance(value, (Pair, Nil)):
+            elements = []
+            while isinstance(value, Pair):
+                element = Compiler.datum_form(value.car)
+                if element is None:
+                    return None
+                elements.append(element)
+                value = value.cdr
+            return elements if value is NIL else None
+        if isinstance(value, (int, float, Fraction, str, Boolean)):
+            return value
+        return None
+
+    def scope_of(env):
+        # the scope of a form running in env:
+        frames, interpreter = [], env.interpreter
+        while env.parent is not None:
+            frames.append(env.names)
+            env = env.parent
+        return Scope(tuple(frames), interpreter)
+
+# the SPECIAL WORDS Compiler.optimize looks inside of (it leaves the others as they are):
+OPTIMIZERS = {
+    'if'     : Compiler.optimize_if,
+    'and'    : Compiler.optimize_andor,
+    'or'     : Compiler.optimize_andor,
+    'lambda' : Compiler.optimize_lambda,
+    'define' : Compiler.optimize_define,
+    'let'    : Compiler.optimize_let,
+    'let*'   : Compiler.optimize_let,
+    'letrec' : Compiler.optimize_let,
+}
+
+# a table of SPECIAL WORDS: maps each one to the function that compiles it
+# (their operands are compiled by those functions rather than evaluated first)
+SPECIAL_WORDS = {
+    'define' : Compiler.compile_define,
+    'define-memo' : Compiler.compile_definememo,
+    'if'     : Compiler.compile_if,
+    'or'     : Compiler.compile_or,
+    'and'    : Compiler.compile_and,
+    'lambda' : Compiler.compile_lambda,
+    'let'    : Compiler.compile_let,
+    'let*'   : Compiler.compile_letstar,
+    'letrec' : Compiler.compile_letrec,
+    'quote'  : Compiler.compile_quote,
+    'delay'  : Compiler.compile_delay,
+    'cons-stream' : Compiler.compile_consstream,
+    'profile': Compiler.compile_profile,
+    'del'    : Compiler.compile_del,
+    'save-image' : Compiler.compile_saveimage,
+}
+
+def runCmd(cmd, env):
+    # cmd is a list of already-evaluated tokens.
     # if nothing in command, return nothing:
     if len(cmd) == 0:
         return None
 
-    # if length of command = 1 then we just have to print symbol requested
+    # if length of command = 1 then we just have to return the value requested
     if len(cmd) == 1:
-        # if the no-argument command is in our symbol table:
-        if cmd[0] in SYMBOLS:
-            # if this is a function name:
-            if isinstance(SYMBOLS[cmd[0]], Function):
-                # if this function takes no arguments, run it:
-                if len(SYMBOLS[cmd[0]].args) == 0:
-                    return SYMBOLS[cmd[0]].run([])
-            # if it's a list, print it:
-            if isinstance(SYMBOLS[cmd[0]], list):
-                # we print lists using a custom function to avoid
-                # showing '' marks on numeric values:
-                Functions.printlist(SYMBOLS[cmd[0]])
-                print()
-            else: print(SYMBOLS[cmd[0]])
-        elif cmd[0] == '$SYMBOLS': # only valid non-symbol command
-            return Functions.printsymbols()
-        elif cmd[0] == 'read' or cmd[0] == 'read-line':
-            return Functions.f_read()
-        else:
-            return Error('Error: symbol %s not found.' %cmd[0])
-
-        return None
+        # if this is a function that takes no arguments, run it:
+        if isinstance(cmd[0], Function) and len(cmd[0].args) == 0:
+            return cmd[0].run([])
+        # symbols that are still symbols after evaluation aren't defined:
+        if isinstance(cmd[0], Symbol):
+            if cmd[0] == '$SYMBOLS': # only valid non-symbol command
+                return Functions.printsymbols(env.interpreter.symbols)
+            elif cmd[0] in INBUILTFUNCTIONS: # an in-built function with no arguments
+                return apply(cmd)
+        # anything else (numbers, lists, quoted symbols, other functions, ...)
+        # is its own value:
+        return cmd[0]
 
     # otherwise, the first token in cmd is the function, and we need to apply it:
     return apply(cmd)
@@ -661,149 +2403,431 @@ def runCmd(cmd):
 #        so it can be used by map() and filter() without rewriting this code
 def apply(cmd):
     # in case a function called another function & returned None:
-    if cmd[0] == 'None': return None
-
-    if cmd[0] == '+':
-        return Functions.f_add(cmd[1:])
-    if cmd[0] == '-':
-        return Functions.f_subtract(cmd[1:])
-    if cmd[0] == '*':
-        return Functions.f_multiply(cmd[1:])
-    if cmd[0] == '/':
-        return Functions.f_divide(cmd[1:])
-    if cmd[0] == '%' or cmd[0] == 'modulus':
-        return Functions.f_modulus(cmd[1:])
-    if cmd[0] == '=' or cmd[0] == 'eq?':
-        return Functions.f_equal(cmd[1:])
-    if cmd[0] == '!=' or cmd[0] == 'neq?':
-        return Functions.f_notequal(cmd[1:])
-    if cmd[0] == '>' or cmd[0] == 'greater?':
-        return Functions.f_greater(cmd[1:])
-    if cmd[0] == '<' or cmd[0] == 'smaller?':
-        return Functions.f_smaller(cmd[1:])
-    if cmd[0] == '>=' or cmd[0] == 'geq?':
-        return Functions.f_greater_or_equal(cmd[1:])
-    if cmd[0] == '<=' or cmd[0] == 'leq?':
-        return Functions.f_smaller_or_equal(cmd[1:])
-    if cmd[0] == 'list':
-        return Functions.make_list(cmd[1:])
-    if cmd[0] == 'car':
-        return Functions.f_car(cmd[1:])
-    if cmd[0] == 'cdr':
-        return Functions.f_cdr(cmd[1:])
-    if cmd[0] == 'cadr':
-        return Functions.f_cadr(cmd[1:])
-    if cmd[0] == 'caddr':
-        return Functions.f_caddr(cmd[1:])
-    if cmd[0] == 'cadddr':
-        return Functions.f_cadddr(cmd[1:])
-    if cmd[0] == 'caddddr':
-        return Functions.f_caddddr(cmd[1:])
-    if cmd[0] == 'reverse':
-        return Functions.f_reverse(cmd[1:])
-    if cmd[0] == 'append':
-        return Functions.f_append(cmd[1:])
-    if cmd[0] == 'cons':
-        return Functions.f_cons(cmd[1:])
-    if cmd[0] == 'length':
-        return Functions.f_length(cmd[1:])
-    if cmd[0] == 'at':
-        return Functions.f_at(cmd[1:])
-    if cmd[0] == 'even?':
-        return Functions.iseven(cmd[1:])
-    if cmd[0] == 'odd?':
-        return Functions.isodd(cmd[1:])
-    if cmd[0] == 'positive?':
-        return Functions.ispositive(cmd[1:])
-    if cmd[0] == 'list?':
-        return Functions.islist(cmd[1:])
-    if cmd[0] == 'display':
-        return Functions.display(cmd[1:])
-    if cmd[0] == 'map':
-        return Functions.map(cmd[1:])
-    if cmd[0] == 'filter':
-        return Functions.filter(cmd[1:])
-    if cmd[0] == 'del':
-        return Functions.f_delete(cmd[1:])
-    if cmd[0] == 'read' or cmd[0] == 'read-line':
-        # no other arguments should be given here
-        print('(read) Error: no arguments expected, received %s.' % len(cmd[1:]))
-        return None
-    if cmd[0] in SYMBOLS:
-        # make sure this is actually a function call:
-        if not isinstance(SYMBOLS[cmd[0]], Function):
-            return Error('Error: %s is not a function.' % cmd[0])
-        # run the function:
-        return SYMBOLS[cmd[0]].run(cmd[1:])
-
-    # otherwise, we haven't recognized the function:
-    return Error('Error: function %s not found.' %cmd[0])
-
-def evaluate(cmd):
-    # first, wrap cmd around parentheses if its first non-whitespace character
-    # is NOT a '('
-    for i in cmd:
-        if not i.isspace():
-            if i != '(':
-                cmd = '(%s)' % cmd
+    if cmd[0] is None: return None
+
+    # user-defined functions are run directly:
+    if isinstance(cmd[0], Function):
+        return cmd[0].run(cmd[1:])
+
+    # in-built functions are looked up in a single table:
+    if isinstance(cmd[0], str) and cmd[0] in INBUILTFUNCTIONS:
+        function, min_args, max_args = INBUILTFUNCTIONS[cmd[0]]
+        args = cmd[1:]
+        # make sure the right number of arguments was given:
+        error = Utils.arity_error(cmd[0], len(args), min_args, max_args)
+        if error is not None:
+            return error
+        return function(args)
+
+    # anything else (including symbols, since unbound names are caught when
+    # they're called) can't be applied:
+    return Error('Error: %s is not a function.' % cmd[0])
+
+def evaluateNode(node, env):
+    # compile a parsed form and run it in env:
+    return Compiler.compile(node, Compiler.scope_of(env))(env)
+
+def evaluate(cmd, env):
+    # parse the source once, then evaluate each top-level form in order:
+    forms = Utils.parse(cmd)
+    if isinstance(forms, Error):
+        return forms
+
+    result = None
+    for form in forms:
+        # a name on its own is looked up, and one that isn't bound is an error
+        # ('$SYMBOLS' lists the global symbols):
+        if isinstance(form, Symbol):
+            if form == '$SYMBOLS':
+                result = Functions.printsymbols(env.interpreter.symbols)
+            elif Utils.unbound(form, env):
+                result = Error('Error: symbol %s not found.' % form)
+            else:
+                result = evaluateNode(form, env)
+        else:
+            result = evaluateNode(form, env)
+        if isinstance(result, Error):
             break
+    return result
+
+# Interpreter: an independent scheme interpreter. each one owns its global symbol
+#              table (and evaluation state), so several can run in one process
+class Interpreter:
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, steps=None, seconds=None, memory=None):
+        self.depth = 0 # how deeply evaluation is currently nested
+        self.budget = None # the Budget of the evaluation running now (if it has limits)
+        self.output = STDOUT # where display writes to (which with-output-to-string changes)
+        self.setMaxDepth(max_depth)
+        self.setLimits(steps, seconds, memory)
+        self.reset()
+
+    def reset(self):
+        # forget every user-defined symbol:
+        self.symbols = SymbolTable({Symbol.intern('newline') : '\n'})
+        self.globals = Environment((), [], interpreter=self)
+
+    def eval(self, source):
+        # evaluate source text, returning the value of its last form (with what
+        # it displayed written out):
+        try:
+            return self.limited(lambda: evaluate(source, self.globals))
+        finally:
+            STDOUT.flush()
+
+    def setLimits(self, steps=None, seconds=None, memory=None):
+        # limit how many steps, seconds and bytes of memory each evaluation may
+        # take (None for no limit; see Budget):
+        self.limits = (steps, seconds, memory)
+
+    def limited(self, run):
+        # call run (a python function of no arguments) as one evaluation, within
+        # this interpreter's limits, and as the interpreter running in this
+        # thread. evaluations inside one of this interpreter's that's running
+        # share its budget:
+        budget = None
+        if self.budget is None and self.limits != (None, None, None):
+            budget = self.budget = Budget(*self.limits)
+        outer, RUNNING.interpreter = RUNNING.interpreter, self
+        try:
+            return run()
+        finally:
+            RUNNING.interpreter = outer
+            if budget is not None:
+                self.budget = None
+                budget.stop()
+
+    def define(self, name, value):
+        # bind name to value in the global symbol table:
+        self.symbols[Symbol.intern(name)] = value
+
+    def saveImage(self, path):
+        # save every global symbol (and whatever their values refer to) to the
+        # file at path, to be loaded back by loadImage:
+        with open(path, 'wb') as f:
+            f.write(IMAGE_MAGIC)
+            ImagePickler(f, self).dump(dict(self.symbols))
+
+    def loadImage(self, path, useMmap=False):
+        # define every global symbol saved by saveImage in the file at path
+        # (read in one go, or mapped into memory), returning an Error if it
+        # isn't an image:
+        with open(path, 'rb') as f:
+            if useMmap:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = io.BytesIO(f.read())
+        try:
+            if data.read(len(IMAGE_MAGIC)) != IMAGE_MAGIC:
+                return Error('Error: %s is not a DragonScheme image.' % path)
+            symbols = ImageUnpickler(data, self).load()
+        except Exception as e:
+            return Error('Error: could not load the image %s: %s' % (path, e))
+        finally:
+            data.close()
+        self.symbols.update(symbols)
+
+    def setMaxDepth(self, depth):
+        # set how deeply non-tail calls may nest, making sure python's own
+        # recursion limit leaves room for that many levels:
+        self.max_depth = depth
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), depth * FRAMES_PER_DEPTH + 100))
+
+# Budget: what's left of the limits of the evaluation running now. steps are calls
+#         to user-defined functions (tail calls included) and promises being
+#         forced; time and memory are checked every STEPS_PER_CHECK steps, and
+#         memory is traced (with tracemalloc) only while it's limited
+class Budget:
+    tracers = 0 # how many budgets are using tracemalloc
+    started = False # (and whether they started it)
+    lock = threading.Lock()
+
+    def __init__(self, steps=None, seconds=None, memory=None):
+        self.steps = steps
+        self.seconds = seconds
+        self.memory = memory
+        self.taken = 0
+        self.deadline = time.monotonic() + seconds if seconds is not None else None
+        # tracemalloc traces the whole process, so it's started by the first
+        # budget with a memory limit (unless it's already tracing) and stopped
+        # by the last one:
+        self.tracing = memory is not None
+        if self.tracing:
+            with Budget.lock:
+                if Budget.tracers == 0:
+                    Budget.started = not tracemalloc.is_tracing()
+                    if Budget.started:
+                        tracemalloc.start()
+                Budget.tracers += 1
+        self.baseline = tracemalloc.get_traced_memory()[0] if memory is not None else 0
+
+    def step(self):
+        # take a step, returning a LimitError if that goes over a limit:
+        self.taken += 1
+        if self.steps is not None and self.taken > self.steps:
+            return LimitError('Error: evaluation stopped after %s steps (the step limit).' % self.steps)
+        if self.taken % STEPS_PER_CHECK == 0:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                return self.overtime()
+            if self.memory is not None and tracemalloc.get_traced_memory()[0] - self.baseline > self.memory:
+                return LimitError('Error: evaluation stopped after using %s bytes of memory (the memory limit).' % self.memory)
+        return None
 
-    # strip opening and closing parentheses, if any:
-    if cmd.count('(') > 0:
-        # ERROR CHECK FIRST: make sure first occurrence of '(' comes before ')':
-        if cmd.find('(')+1 > cmd.rfind(')'):
-            return Error('Error: invalid parentheses.')
-
-        # now strip the parentheses
-        cmd = cmd[cmd.find('(')+1 : cmd.rfind(')')]
-
-    # strip cmd of any leading and trailing whitespace:
-    cmd = cmd.lstrip().rstrip()
-
-    # if this is a number or a special symbol, return itself:
-    if Utils.isnumber(cmd) or cmd in BOOLS.values():
-        return cmd
-
-    # if the command starts with any special words (define, if, cond, etc.), process it differently:
-    if cmd.startswith(tuple(SPECIAL_WORDS)):
-        return processSpecial(cmd)
-
-    # if there are no parentheses left, evaluate & return result:
-    elif cmd.count('(') == 0:
-        return runCmd(cmd)
-
-    # find first matching parentheses:
-    # NOTE: can't use find() and rfind() here because of situations like (foo (bar) (fib))
-    l = cmd.find('(')
-    r = l
-    ct = 0
-    for i in range(l+1, len(cmd)):
-        if cmd[i] == ')':
-            if ct == 0:
-                r = i+1
-                break
-            ct += 1
-        elif cmd[i] == '(':
-            ct -= 1
-
-    cmd = cmd[:l] + str(evaluate(cmd[l:r])) + cmd[r:]
-    return evaluate(cmd)
+    def overtime(self):
+        return LimitError('Error: evaluation stopped after %s seconds (the time limit).' % self.seconds)
+
+    def remaining(self):
+        # the limits left, for work done elsewhere (like in pmap's workers):
+        steps = self.steps - self.taken if self.steps is not None else None
+        seconds = Budget.left(self.deadline - time.monotonic()) if self.deadline is not None else None
+        return (steps, seconds, self.memory)
+
+    def left(seconds):
+        # (time that's run out is none left, rather than negative)
+        return max(seconds, 0) if seconds is not None else None
+
+    def stop(self):
+        if self.tracing:
+            with Budget.lock:
+                Budget.tracers -= 1
+                if Budget.tracers == 0 and Budget.started:
+                    tracemalloc.stop()
+
+# Running: the interpreter whose evaluation is running in each thread, for the
+#          in-built functions and promises that need it (the budget promises
+#          take steps from, and the output port display writes to)
+class Running(threading.local):
+    interpreter = None
+
+RUNNING = Running()
+
+# ImagePickler and ImageUnpickler: pickle an interpreter's global symbols, with
+#                                 the interpreter (and its global frame) saved
+#                                 as references, so whatever loads them back
+#                                 gets its own in their place
+class ImagePickler(pickle.Pickler):
+    def __init__(self, file, interpreter):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.interpreter = interpreter
+
+    def persistent_id(self, obj):
+        if obj is self.interpreter:
+            return 'interpreter'
+        if obj is self.interpreter.globals:
+            return 'globals'
+        return None
 
-if __name__ == '__main__':
+class ImageUnpickler(pickle.Unpickler):
+    def __init__(self, file, interpreter):
+        pickle.Unpickler.__init__(self, file)
+        self.interpreter = interpreter
+
+    def persistent_load(self, pid):
+        if pid == 'interpreter':
+            return self.interpreter
+        if pid == 'globals':
+            return self.interpreter.globals
+        raise pickle.UnpicklingError('unknown reference %s' % pid)
+
+# Profiler: records how many times each in-built and user-defined function is
+#           called, and how long those calls take (with and without the calls
+#           they make to other functions). it works through python's profiling
+#           hook, so nothing is recorded (or slowed down) while it isn't running
+class Profiler:
+    def __init__(self):
+        self.stats = {} # name -> [calls, self time, cumulative time]
+        self.stack = [] # [frame, name, start, time in profiled calls] per running call
+        self.running = {} # name -> how many calls to it are running
+        # in-built functions are recognized by their code, and user-defined ones
+        # by their calls to tailcall (once per tail call):
+        self.codes = {Function.tailcall.__code__ : None, MemoFunction.tailcall.__code__ : None}
+        for name, (function, min_args, max_args) in INBUILTFUNCTIONS.items():
+            self.codes.setdefault(function.__code__, name)
+        # an in-built function only counts when the program called it (through
+        # one of these), not when another in-built function used it:
+        self.dispatchers = {apply.__code__}
+        for function in (Compiler.compile_builtin, Utils.caller):
+            self.dispatchers.update(c for c in function.__code__.co_consts if hasattr(c, 'co_code'))
+
+    def start(self):
+        sys.setprofile(self.hook)
+
+    def stop(self):
+        sys.setprofile(None)
+
+    def hook(self, frame, event, arg):
+        if event == 'call':
+            if frame.f_code not in self.codes:
+                return
+            name = self.codes[frame.f_code]
+            caller = frame.f_back.f_code if frame.f_back is not None else None
+            if name is None:
+                # (a memoized function's call runs the function underneath it,
+                # which isn't another call)
+                if caller is MemoFunction.tailcall.__code__:
+                    return
+                name = Profiler.label(frame.f_locals['self'])
+            elif caller not in self.dispatchers:
+                return
+            self.stack.append([frame, name, time.perf_counter(), 0.0])
+            self.running[name] = self.running.get(name, 0) + 1
+        elif event == 'return' and self.stack and self.stack[-1][0] is frame:
+            frame, name, start, inner = self.stack.pop()
+            elapsed = time.perf_counter() - start
+            stats = self.stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed - inner
+            # a recursive call's time is already part of the outermost one's:
+            self.running[name] -= 1
+            if self.running[name] == 0:
+                stats[2] += elapsed
+            if self.stack:
+                self.stack[-1][3] += elapsed
+
+    def label(function):
+        # what a user-defined function is called in reports:
+        if function.name is not None:
+            return str(function.name)
+        return '(lambda (%s))' % ' '.join(function.args)
+
+    def report(self, form='text'):
+        # the stats sorted by cumulative time, as a table or as JSON:
+        rows = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+        if form == 'json':
+            return json.dumps([{'name' : name, 'calls' : calls, 'self' : self_time, 'cumulative' : cumulative}
+                               for name, (calls, self_time, cumulative) in rows], indent=2)
+        width = max([len(name) for name, stats in rows] + [len('function')])
+        lines = ['%-*s %10s %12s %12s' % (width, 'function', 'calls', 'self (s)', 'total (s)')]
+        for name, (calls, self_time, cumulative) in rows:
+            lines.append('%-*s %10d %12.6f %12.6f' % (width, name, calls, self_time, cumulative))
+        return '\n'.join(lines)
+
+# (in the worker processes of pmap and pfilter) the interpreter functions run in
+WORKER = None
+
+def poolInit(definitions, max_depth, limits):
+    # start a worker process with an interpreter holding the caller's
+    # definitions (and the limits the caller has left):
+    global WORKER
+    # (a forked worker starts with copies of the caller's buffers, which are
+    # the caller's to write out)
+    for port in [STDOUT] + list(OPEN_PORTS):
+        port.pending, port.size = [], 0
+    WORKER = Interpreter(max_depth, *limits)
+    # (time left runs out at the same moment for every chunk it runs)
+    steps, seconds, memory = limits
+    WORKER.deadline = time.monotonic() + seconds if seconds is not None else None
+    for name, form in definitions:
+        WORKER.symbols[name] = evaluateNode(form, WORKER.globals)
+
+def poolRun(functionForm, forms):
+    # apply a function to a chunk of values in a worker process, returning the
+    # forms of the results (or the first error):
+    def run():
+        function = evaluateNode(functionForm, WORKER.globals)
+        results = []
+        for form in forms:
+            result = apply([function, evaluateNode(form, WORKER.globals)])
+            if isinstance(result, Error):
+                return result
+            results.append(Utils.to_form(result))
+        return results
+    if WORKER.deadline is not None:
+        steps, seconds, memory = WORKER.limits
+        WORKER.setLimits(steps, Budget.left(WORKER.deadline - time.monotonic()), memory)
+    try:
+        return WORKER.limited(run)
+    finally:
+        STDOUT.flush()
+
+def cachePath(path, cacheDir=None):
+    # where the parsed forms of the script file at path are cached: in CACHE_DIR
+    # next to it, or in cacheDir (named after its full path) if one is given:
+    path = os.path.abspath(path)
+    if cacheDir is None:
+        return os.path.join(os.path.dirname(path), CACHE_DIR, os.path.basename(path) + '.pickle')
+    key = hashlib.sha256(path.encode()).hexdigest()[:16]
+    return os.path.join(cacheDir, '%s-%s.pickle' % (os.path.basename(path), key))
+
+def parseFile(path, source, cacheDir=None):
+    # parse the source of the script file at path, reusing the forms cached the
+    # last time it was parsed if neither its modification time nor its contents
+    # have changed since (and caching them otherwise):
+    cache = cachePath(path, cacheDir)
+    key = {
+        'version' : CACHE_VERSION,
+        'path' : os.path.abspath(path),
+        'mtime' : os.stat(path).st_mtime_ns,
+        'hash' : hashlib.sha256(source.encode()).hexdigest(),
+    }
+    try:
+        with open(cache, 'rb') as f:
+            entry = pickle.load(f)
+        if entry['key'] == key:
+            return entry['forms']
+    except Exception:
+        pass # (a missing, stale or broken cache just means parsing again)
+
+    forms = Utils.parse(source)
+    if isinstance(forms, Error):
+        return forms
+    # write the cache under a temporary name first, so a half-written one is
+    # never read (and a cache that can't be written isn't an error):
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(cache + '.%s.tmp' % os.getpid(), 'wb') as f:
+            pickle.dump({'key' : key, 'forms' : forms}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, cache)
+    except OSError:
+        pass
+    return forms
+
+def runScript(interpreter, source, name='<stdin>', stopOnError=False, forms=None):
+    # run every top-level form of a script without any prompts, reporting errors
+    # on stderr (forms, if given, are the already-parsed source). returns the
+    # number of forms that failed:
+    if forms is None:
+        forms = Utils.parse(source)
+    if isinstance(forms, Error):
+        print('%s: %s' % (name, forms), file=sys.stderr)
+        return 1
+
+    # the whole script is one evaluation (as far as its limits go), and going
+    # over one stops it:
+    def run():
+        errors = 0
+        for form in forms:
+            try:
+                result = evaluateNode(form, interpreter.globals)
+            except Exception:
+                result = Error('Error: invalid input.')
+            if isinstance(result, Error):
+                # (what the script displayed before the error comes first)
+                STDOUT.flush()
+                print('%s: %s' % (name, result), file=sys.stderr)
+                errors += 1
+                if stopOnError or isinstance(result, LimitError): break
+        return errors
+    try:
+        return interpreter.limited(run)
+    finally:
+        STDOUT.flush()
+
+def repl(interpreter):
     cmd = 'pass'
 
     while cmd != 'exit':
-        # print prompt:
-        print('--> ', end='')
-        # take user input:
-        cmd = input()
-
-        # ignore comments in user input:
-        if cmd.find(';') > 0:
-            cmd = cmd[:cmd.find(';')]
+        # print prompt (along with anything still waiting to be written out):
+        STDOUT.write('--> ')
+        STDOUT.flush()
+        # take user input (stopping at the end of input):
+        try:
+            cmd = input()
+        except EOFError:
+            STDOUT.write('\n')
+            break
 
         # if user typed 'exit', break out of the loop:
-        if cmd == 'exit': break
+        if cmd.strip() == 'exit': break
 
         # variable to keep track of whether user typed 'scratch' in the loop:
         isScratch = False
@@ -811,41 +2835,147 @@ if __name__ == '__main__':
         # if cmd has unbalanced parentheses, wait until they're balanced:
         while Utils.unbalanced(cmd):
             # print extra prompt:
-            print('... ', end='')
+            STDOUT.write('... ')
+            STDOUT.flush()
 
             # accept extra input:
-            extraInput = ' ' + input() + ' '
-            # cut everything after semicolon, if present:
-            if extraInput.find(';') > 0:
-                extraInput = extraInput[:extraInput.find(';')]
+            try:
+                extraInput = input()
+            except EOFError:
+                isScratch = True
+                break
 
             # did the user type 'scratch'?
-            if extraInput == ' scratch ':
+            if extraInput.strip() == 'scratch':
                 isScratch = True
                 break
 
-            cmd += extraInput
+            cmd += '\n' + extraInput
 
         # if the user entered 'scratch', then we reset the entire command & start over:
         if isScratch: continue
 
         # evaluate cmd:
         try:
-            result = evaluate(Utils.clean(cmd))
+            result = interpreter.eval(cmd)
         except:
-            print('Error: invalid input.')
+            STDOUT.write('Error: invalid input.\n')
             continue
 
         # if result wasn't None, print it out:
         if result != None:
-            if result in SYMBOLS:
-                runCmd(result)
-            else: print(result)
-
-        # GARBAGE COLLECTION: clear symbol table of all temps:
-        while GLOBALS['NUM_TEMPS'] >= 0:
-            temp_name = '<TEMP_' + str(GLOBALS['NUM_TEMPS']) + '>'
-            if temp_name in SYMBOLS:
-                del SYMBOLS[temp_name]
-            GLOBALS['NUM_TEMPS'] -= 1
-        GLOBALS['NUM_TEMPS'] = 0 # after the loop it'll be -1
+            STDOUT.write(Utils.to_text(result) + '\n')
+
+    STDOUT.flush()
+
+def parseSize(text):
+    # read a number of bytes, like '4096', '64K' or '1.5G':
+    units = {'K' : 1024, 'M' : 1024 ** 2, 'G' : 1024 ** 3}
+    multiplier = units.get(text[-1:].upper(), 1)
+    try:
+        return int(float(text[:-1] if multiplier > 1 else text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size: %s' % text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DragonScheme: a scheme interpreter, written by ori yonay')
+    parser.add_argument('files', nargs='*',
+                        help="scheme files to run in order ('-' reads standard input); "
+                             "starts the interactive prompt if none are given")
+    parser.add_argument('--stop-on-error', action='store_true',
+                        help='stop running at the first form that returns an error')
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH,
+                        help='how deeply non-tail calls may nest (default: %(default)s)')
+    parser.add_argument('--max-steps', type=int, metavar='N',
+                        help='stop each file (or command, at the prompt) after N steps (calls to '
+                             'user-defined functions and promises forced)')
+    parser.add_argument('--time-limit', type=float, metavar='SECONDS',
+                        help='stop each file (or command) after SECONDS seconds')
+    parser.add_argument('--memory-limit', type=parseSize, metavar='SIZE',
+                        help="stop each file (or command) once it's using SIZE more bytes of memory "
+                             "(with an optional K, M or G suffix, like 512M)")
+    parser.add_argument('--no-optimize', action='store_true',
+                        help='run function bodies exactly as written, without folding constants first')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="parse every file from scratch, without reading or writing the '%s' caches" % CACHE_DIR)
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help="keep the parsed forms of files in DIR instead of a '%s' next to each" % CACHE_DIR)
+    parser.add_argument('--image', metavar='FILE',
+                        help='start with the global symbols saved in FILE by (save-image "FILE")')
+    parser.add_argument('--image-mmap', action='store_true',
+                        help='map the image into memory instead of reading it')
+    parser.add_argument('--profile', action='store_true',
+                        help='print how many times each function was called, and for how long, '
+                             'to standard error when done')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help="write the same report as JSON to FILE ('-' for standard output)")
+    args = parser.parse_args(argv)
+
+    # allow printing integers of any size (only when running as a program, so
+    # whatever embeds the interpreter keeps python's limit):
+    if hasattr(sys, 'set_int_max_str_digits'):
+        sys.set_int_max_str_digits(0)
+
+    global OPTIMIZE
+    OPTIMIZE = not args.no_optimize
+    interpreter = Interpreter(args.max_depth, args.max_steps, args.time_limit, args.memory_limit)
+    if args.image:
+        try:
+            error = interpreter.loadImage(args.image, args.image_mmap)
+        except (OSError, ValueError) as e:
+            error = Error('Error: could not read %s: %s' % (args.image, e))
+        if error is not None:
+            print(error, file=sys.stderr)
+            return 1
+
+    # profile everything run, if asked to:
+    if args.profile or args.profile_json:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            status = runFiles(interpreter, args)
+        finally:
+            profiler.stop()
+        if args.profile:
+            print(profiler.report(), file=sys.stderr)
+        if args.profile_json == '-':
+            print(profiler.report('json'))
+        elif args.profile_json:
+            with open(args.profile_json, 'w') as f:
+                f.write(profiler.report('json') + '\n')
+        return status
+    return runFiles(interpreter, args)
+
+def runFiles(interpreter, args):
+    # run the files given on the command line (or the interactive prompt if
+    # there are none), returning the exit status.
+    # with no files, run the interactive prompt:
+    if len(args.files) == 0:
+        repl(interpreter)
+        return 0
+
+    # otherwise, run each file (all in the same interpreter) without prompts:
+    status = 0
+    for path in args.files:
+        forms = None
+        try:
+            if path == '-':
+                name, source = '<stdin>', sys.stdin.read()
+            else:
+                with open(path) as f:
+                    name, source = path, f.read()
+                if not args.no_cache:
+                    forms = parseFile(path, source, args.cache_dir)
+        except OSError as e:
+            print('Error: could not read %s: %s' % (path, e.strerror), file=sys.stderr)
+            status = 1
+            if args.stop_on_error: break
+            continue
+
+        if runScript(interpreter, source, name, args.stop_on_error, forms) > 0:
+            status = 1
+            if args.stop_on_error: break
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,6 @@
+; deeply nested non-tail recursion
+(define (ack m n)
+  (if (= m 0) (+ n 1)
+      (if (= n 0) (ack (- m 1) 1)
+          (ack (- m 1) (ack m (- n 1))))))
+(ack 2 120)
@@ -0,0 +1,6 @@
+; deeply nested arithmetic, with exact and inexact numbers
+(define (poly x)
+  (+ (* 3 (* x (* x (* x x)))) (- (* 2 (* x (* x x))) (/ (+ (* x x) (- x 1)) 7))
+     (* (+ x 1) (- x 1) (+ x 2) (- x 2)) (/ (* 1.5 x) (+ 2 (* 0.5 x)))))
+(define (total i acc) (if (= i 0) acc (total (- i 1) (+ acc (poly i)))))
+(total 5000 0)
@@ -0,0 +1,12 @@
+; long function definitions, where each call runs many forms through Function.run
+(define (step a b c)
+  (define x (+ a b))
+  (define y (* x c))
+  (define z (- y a))
+  (if (> z 100)
+      (if (and (< a b) (or (= c 0) (> (+ x y z) 0))) (+ x y z) (- x y z))
+      (if (or (= a b) (< z 0)) (- x y) (* z 2))))
+(define (run i acc)
+  (if (= i 0) acc
+      (run (- i 1) (+ acc (step i (+ i 1) (% i 7)) (step (- i) i 3)))))
+(run 10000 0)
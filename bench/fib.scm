@@ -0,0 +1,3 @@
+; non-tail recursion: every call to fib makes two more
+(define (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+(fib 18)
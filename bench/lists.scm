@@ -0,0 +1,7 @@
+; building a list with cons, then walking it with car and cdr
+(define (build n acc) (if (= n 0) acc (build (- n 1) (cons n acc))))
+(define (sum mylist acc) (if (null? mylist) acc (sum (cdr mylist) (+ acc (car mylist)))))
+(define numbers (build 20000 (list)))
+(sum numbers 0)
+(length (reverse numbers))
+(length (append numbers numbers))
@@ -0,0 +1,8 @@
+; map and filter over a large list, with user-defined and in-built functions
+(define (build n acc) (if (= n 0) acc (build (- n 1) (cons n acc))))
+(define numbers (build 20000 (list)))
+(define (square x) (* x x))
+(length (map square numbers))
+(length (filter (lambda (x) (= (% x 3) 0)) numbers))
+(length (map + numbers numbers))
+(length (filter even? (list->vector numbers)))
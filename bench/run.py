@@ -0,0 +1,135 @@
+"""
+benchmarks for DragonScheme: runs each workload (a .scm file in this directory)
+in a fresh interpreter, a few times over, and reports how many runs it manages
+per second and how much memory a run takes at its peak, as JSON.
+
+usage:
+    python bench/run.py                          runs every workload
+    python bench/run.py fib lists                runs some of them
+    python bench/run.py --output base.json       saves the results too
+    python bench/run.py --compare base.json      flags workloads that got slower
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+import DragonScheme
+
+DEFAULT_WARMUP = 1 # runs before timing starts, which aren't counted
+DEFAULT_REPS = 5 # timed runs of each workload
+DEFAULT_THRESHOLD = 0.10 # how much slower than the baseline counts as a regression
+
+def workloads(names):
+    # map the name of each workload (or only the ones in names) to its source:
+    paths = sorted(glob.glob(os.path.join(BENCH_DIR, '*.scm')))
+    found = {os.path.splitext(os.path.basename(path))[0] : path for path in paths}
+    for name in names:
+        if name not in found:
+            sys.exit('error: no workload named %s (there are: %s)' % (name, ', '.join(found)))
+    sources = {}
+    for name, path in found.items():
+        if len(names) == 0 or name in names:
+            with open(path) as f:
+                sources[name] = f.read()
+    return sources
+
+def runOnce(name, source):
+    # run a workload in a fresh interpreter, returning how long it took:
+    interpreter = DragonScheme.Interpreter()
+    start = time.perf_counter()
+    result = interpreter.eval(source)
+    elapsed = time.perf_counter() - start
+    if isinstance(result, DragonScheme.Error):
+        sys.exit('error: workload %s failed: %s' % (name, result))
+    return elapsed
+
+def bench(name, source, warmup, reps):
+    # time a workload, then measure its peak memory in a separate run (since
+    # tracing allocations slows everything down):
+    for i in range(warmup):
+        runOnce(name, source)
+    times = [runOnce(name, source) for i in range(reps)]
+
+    tracemalloc.start()
+    runOnce(name, source)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec' : 1 / statistics.mean(times),
+        'mean' : statistics.mean(times),
+        'min' : min(times),
+        'stdev' : statistics.stdev(times) if len(times) > 1 else 0.0,
+        'peak_memory' : peak,
+    }
+
+def compare(results, baseline, threshold):
+    # print how each workload did against the baseline, returning the names of
+    # the ones that got slower by more than threshold:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print('%-12s (not in baseline)' % name, file=sys.stderr)
+            continue
+        change = result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1
+        memory = result['peak_memory'] / max(baseline[name]['peak_memory'], 1) - 1
+        regressed = change < -threshold
+        print('%-12s %+7.1f%% ops/sec %+7.1f%% peak memory%s'
+              % (name, change * 100, memory * 100, '  REGRESSION' if regressed else ''), file=sys.stderr)
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmarks for DragonScheme')
+    parser.add_argument('names', nargs='*', help='workloads to run (default: all of them)')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP,
+                        help='untimed runs of each workload first (default: %(default)s)')
+    parser.add_argument('--reps', type=int, default=DEFAULT_REPS,
+                        help='timed runs of each workload (default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE', help='also write the results to FILE')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare against the results saved in FILE, exiting with status 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='the fraction of ops/sec a workload may lose before it counts '
+                             'as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.reps < 1:
+        parser.error('--reps must be at least 1')
+
+    results = {}
+    for name, source in workloads(args.names).items():
+        results[name] = bench(name, source, args.warmup, args.reps)
+
+    report = {
+        'python' : platform.python_version(),
+        'warmup' : args.warmup,
+        'reps' : args.reps,
+        'results' : results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                baseline = json.load(f)['results']
+        except (OSError, ValueError, KeyError) as e:
+            sys.exit('error: could not read a baseline from %s: %s' % (args.compare, e))
+        if len(compare(results, baseline, args.threshold)) > 0:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
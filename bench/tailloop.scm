@@ -0,0 +1,4 @@
+; tail calls, which run on the trampoline in constant stack
+(define (loop i acc) (if (= i 0) acc (loop (- i 1) (+ acc i))))
+(loop 50000 0)
+(let count ((i 0)) (if (< i 50000) (count (+ i 1)) i))